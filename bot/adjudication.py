@@ -0,0 +1,81 @@
+from typing import Optional
+
+import chess.engine
+
+from enums import Adjudication
+
+MATE_SCORE = 100000
+
+
+class Adjudicator:
+    """Resigns lost games and offers or accepts draws in dead drawn ones.
+
+    Decisions are made from the scores of our own searches, in centipawns
+    from our side. A game is resigned once `resign_moves` scores in a row
+    are at or below `-resign_score`, and a draw is offered once
+    `draw_moves` scores in a row are within `draw_score` of zero, no earlier
+    than `draw_min_ply` and at most every `OFFER_INTERVAL` plies. Draw
+    offers of the opponent are accepted under the same conditions, or when
+    we are losing, and declined without enough scores to tell. A threshold
+    of zero moves disables its rule.
+    """
+
+    OFFER_INTERVAL = 20
+
+    def __init__(
+        self,
+        *,
+        resign_score: int = 1000,
+        resign_moves: int = 0,
+        draw_score: int = 10,
+        draw_moves: int = 0,
+        draw_min_ply: int = 60,
+    ):
+        self.resign_score = resign_score
+        self.resign_moves = resign_moves
+        self.draw_score = draw_score
+        self.draw_moves = draw_moves
+        self.draw_min_ply = draw_min_ply
+        self.decisions = {adjudication: 0 for adjudication in Adjudication}
+
+    @staticmethod
+    def score(info: chess.engine.InfoDict) -> Optional[int]:
+        """The score of a search from the side to move, or None if it was not reported."""
+        if "score" not in info:
+            return None
+        return info["score"].relative.score(mate_score=MATE_SCORE)
+
+    def decide(
+        self, scores: "list[int]", ply: int, last_offer: Optional[int] = None
+    ) -> Optional[Adjudication]:
+        """Decides what to do along with the move about to be played."""
+        if (
+            self.resign_moves > 0
+            and len(scores) >= self.resign_moves
+            and all(s <= -self.resign_score for s in scores[-self.resign_moves :])
+        ):
+            return self._count(Adjudication.RESIGN)
+        if (
+            self.draw_moves > 0
+            and ply >= self.draw_min_ply
+            and (last_offer is None or ply - last_offer >= self.OFFER_INTERVAL)
+            and len(scores) >= self.draw_moves
+            and all(abs(s) <= self.draw_score for s in scores[-self.draw_moves :])
+        ):
+            return self._count(Adjudication.OFFER_DRAW)
+        return None
+
+    def answer_draw(self, scores: "list[int]", ply: int) -> Adjudication:
+        """Answers a draw offer of the opponent."""
+        if (
+            self.draw_moves > 0
+            and ply >= self.draw_min_ply
+            and len(scores) >= self.draw_moves
+            and all(s <= self.draw_score for s in scores[-self.draw_moves :])
+        ):
+            return self._count(Adjudication.ACCEPT_DRAW)
+        return self._count(Adjudication.DECLINE_DRAW)
+
+    def _count(self, adjudication: Adjudication) -> Adjudication:
+        self.decisions[adjudication] += 1
+        return adjudication
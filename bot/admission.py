@@ -0,0 +1,174 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from datamodels import Challenge
+from enums import AdmissionDecision, DeclineReason, Variant
+from registry import GameRegistry
+
+
+class AdmissionController:
+    """Decides which challenges to accept from the engine capacity left.
+
+    Every game is charged an estimated load, in engines, from its time
+    control, against a capacity of `capacity` engines. Challenges that do
+    not fit are queued while the queue has room and declined with a Lichess
+    decline reason otherwise. Running games are read from the game registry;
+    accepted challenges are held as pending until their game starts.
+
+    No challenge is accepted before `ready` is set, once an engine can play;
+    until then, challenges that would fit are queued.
+    """
+
+    GAME_LOAD = 0.5
+    BULLET_DURATION = 180
+    UNTIMED_LOAD = 0.1
+
+    def __init__(
+        self,
+        capacity: int,
+        games: GameRegistry,
+        *,
+        max_games: int = 0,
+        max_load: float = 1.0,
+        queue_size: int = 4,
+        queue_timeout: float = 20,
+        min_duration: float = 0,
+        max_duration: float = 0,
+    ):
+        self.capacity = max(1, capacity)
+        self.games = games
+        self.max_games = max_games or 2 * self.capacity
+        self.max_load = max_load
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.pending: "dict[str, tuple[float, float]]" = {}
+        self.queue: "OrderedDict[str, tuple[Challenge, float]]" = OrderedDict()
+        self.decisions = {decision: 0 for decision in AdmissionDecision}
+        self.ready = False
+
+    @staticmethod
+    def clock_duration(limit: int, increment: int) -> float:
+        """Estimated length of a game in seconds of each side's clock."""
+        return limit + 40 * increment
+
+    @staticmethod
+    def duration(challenge: Challenge) -> Optional[float]:
+        if challenge.time_control is None:
+            return None
+        return AdmissionController.clock_duration(
+            challenge.time_control.limit, challenge.time_control.increment
+        )
+
+    def clock_load(self, limit: int, increment: int) -> float:
+        duration = self.clock_duration(limit, increment)
+        # Waiting for an engine costs fast games a bigger share of their clock
+        return min(
+            1.0, self.GAME_LOAD * max(1.0, self.BULLET_DURATION / max(duration, 1))
+        )
+
+    def load(self, challenge: Challenge) -> float:
+        if challenge.time_control is None:
+            return self.UNTIMED_LOAD
+        return self.clock_load(
+            challenge.time_control.limit, challenge.time_control.increment
+        )
+
+    @property
+    def utilisation(self) -> float:
+        pending = sum(load for load, _ in self.pending.values())
+        return (self.games.load + pending) / self.capacity
+
+    def fits_load(self, load: float) -> bool:
+        return (
+            len(self.games) + len(self.pending) < self.max_games
+            and self.utilisation + load / self.capacity <= self.max_load
+        )
+
+    def fits(self, challenge: Challenge) -> bool:
+        return self.fits_load(self.load(challenge))
+
+    def decide(
+        self, challenge: Challenge
+    ) -> "tuple[AdmissionDecision, Optional[DeclineReason]]":
+        decision, reason = self._decide(challenge)
+        self.decisions[decision] += 1
+        if decision == AdmissionDecision.ACCEPT:
+            self.admit(challenge)
+        elif decision == AdmissionDecision.QUEUE:
+            self.queue[challenge.id] = (challenge, time.monotonic())
+        return decision, reason
+
+    def _decide(
+        self, challenge: Challenge
+    ) -> "tuple[AdmissionDecision, Optional[DeclineReason]]":
+        if challenge.variant != Variant.STANDARD:
+            return AdmissionDecision.DECLINE, DeclineReason.STANDARD
+
+        duration = self.duration(challenge)
+        if duration is not None:
+            if self.min_duration and duration < self.min_duration:
+                return AdmissionDecision.DECLINE, DeclineReason.TOO_FAST
+            if self.max_duration and duration > self.max_duration:
+                return AdmissionDecision.DECLINE, DeclineReason.TOO_SLOW
+
+        if self.ready and not self.queue and self.fits(challenge):
+            return AdmissionDecision.ACCEPT, None
+        if len(self.queue) < self.queue_size:
+            return AdmissionDecision.QUEUE, None
+        return AdmissionDecision.DECLINE, DeclineReason.LATER
+
+    def admit(self, challenge: Challenge):
+        self.reserve(challenge.id, self.load(challenge), self.queue_timeout)
+
+    def reserve(self, challenge_id: str, load: float, timeout: float):
+        """Holds `load` for a game expected to start within `timeout` seconds."""
+        self.pending[challenge_id] = (load, time.monotonic() + timeout)
+
+    def claim(self, game_id: str) -> float:
+        """Returns the load of a starting game, which is no longer pending.
+
+        Games that started without an accepted challenge, such as the ones we
+        sent, are charged the default load.
+        """
+        load, _ = self.pending.pop(game_id, (self.GAME_LOAD, 0))
+        return load
+
+    def release(self, challenge_id: str):
+        self.pending.pop(challenge_id, None)
+
+    def cancel(self, challenge_id: str):
+        self.queue.pop(challenge_id, None)
+
+    def drain(self) -> "list[Challenge]":
+        """Admits the queued challenges that fit now, in arrival order."""
+        admitted = []
+        while self.ready and self.queue:
+            challenge, _ = next(iter(self.queue.values()))
+            if not self.fits(challenge):
+                break
+            self.queue.popitem(last=False)
+            self.admit(challenge)
+            admitted.append(challenge)
+        return admitted
+
+    def expire(self) -> "list[Challenge]":
+        """Removes the challenges that have waited longer than the queue timeout.
+
+        Accepted challenges whose game never started are dropped as well.
+        """
+        now = time.monotonic()
+        for challenge_id, (_, expires_at) in list(self.pending.items()):
+            if expires_at < now:
+                del self.pending[challenge_id]
+        deadline = now - self.queue_timeout
+        expired = [
+            challenge
+            for challenge, queued_at in self.queue.values()
+            if queued_at < deadline
+        ]
+        for challenge in expired:
+            del self.queue[challenge.id]
+        return expired
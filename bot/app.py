@@ -1,22 +1,47 @@
 import asyncio
 import os
-import traceback
-from io import StringIO
-from random import choice
-from typing import Coroutine
+import signal
+import time
+from typing import Any, AsyncIterator, Coroutine, Optional
 
 import aiohttp
 import chess
 import chess.engine
+from aiohttp import web
 from dotenv import load_dotenv
 
+from adjudication import Adjudicator
+from admission import AdmissionController
+from archive import GameArchive, game_record
+from boardsync import BoardSynchronizer
+from book import OpeningBook
+from backoff import Backoff
 from colorlogs import Color, Logger
 from datamodels import APIEvent, BotUser, Game, GameStateEvent
+from engines import EnginePool
+from evalcache import EvalCache
 from enums import Color as GameColor
-from enums import EventType, GameStatus, Variant
-from errors import ConnectionFailure, JSONDecodeFailure
-from looping import Loop
-from utils import decode_json
+from enums import (
+    Adjudication,
+    AdmissionDecision,
+    DeclineReason,
+    EventType,
+    GameStatus,
+    RequestPriority,
+)
+from errors import ConnectionFailure
+from looping import Loop, Scheduler
+from matchmaking import BotDirectory, Matchmaker, parse_clocks
+from metrics import Metrics, StartupTimer
+from pondering import Ponderer
+from profiles import load_profiles
+from profiling import LoopMonitor, SamplingProfiler
+from ratelimit import RequestScheduler
+from registry import GameRegistry
+from search import AdaptiveSearch
+from tablebase import Tablebase
+from timemanager import MoveBudget, TimeManager, parse_margins
+from utils import iter_ndjson
 
 load_dotenv()
 TOKEN = os.getenv("TOKEN")
@@ -35,25 +60,419 @@ class AppMainFunction:
 
 class App:
     session: aiohttp.ClientSession
-    engine: chess.engine.SimpleEngine
+    http: RequestScheduler
+    engines: EnginePool
+    book: Optional[OpeningBook]
+    tablebase: Optional[Tablebase]
+    eval_cache: Optional[EvalCache]
+    archive: Optional[GameArchive]
+    time_manager: TimeManager
+    search: Optional[AdaptiveSearch]
+    adjudicator: Optional[Adjudicator]
+    metrics: Metrics
+    monitor: Optional[LoopMonitor]
+    profiler: SamplingProfiler
+    admission: AdmissionController
+    matchmaker: Optional[Matchmaker]
     log: Logger
     call: AppMainFunction
-    games: "list[str]"
+    games: GameRegistry
+    ponder: bool
     challenges: "ChallengesHandler"
-    _loops: "list[Loop]"
+    scheduler: Scheduler
+    startup: StartupTimer
+
+    STARTUP_PHASES = ("engines", "preconnect", "stream")
 
     def __init__(self):
         self.log = Logger()
-        self.games = []
+        self.games = GameRegistry()
+        self.book = None
+        self.tablebase = None
+        self.eval_cache = None
+        self.archive = None
+        self.monitor = None
+        self.matchmaker = None
+        self._tasks: "set[asyncio.Task]" = set()
+        self.time_manager = TimeManager(
+            safety_margin=float(os.getenv("TIME_SAFETY_MARGIN", "0.3")),
+            variant_margins=parse_margins(os.getenv("TIME_VARIANT_MARGINS")),
+            panic_time=float(os.getenv("TIME_PANIC", "5")),
+        )
+        self.adjudicator = None
+        if (
+            int(os.getenv("RESIGN_MOVES", "0")) > 0
+            or int(os.getenv("DRAW_MOVES", "0")) > 0
+        ):
+            self.adjudicator = Adjudicator(
+                resign_score=int(os.getenv("RESIGN_SCORE", "1000")),
+                resign_moves=int(os.getenv("RESIGN_MOVES", "0")),
+                draw_score=int(os.getenv("DRAW_SCORE", "10")),
+                draw_moves=int(os.getenv("DRAW_MOVES", "0")),
+                draw_min_ply=int(os.getenv("DRAW_MIN_PLY", "60")),
+            )
+        self.search = None
+        if os.getenv("ADAPTIVE_SEARCH", "false").lower() in ("1", "true", "yes"):
+            self.search = AdaptiveSearch(
+                stability=int(os.getenv("SEARCH_STABILITY", "4")),
+                separation=int(os.getenv("SEARCH_SEPARATION", "150")),
+                drop=int(os.getenv("SEARCH_DROP", "30")),
+                multipv=int(os.getenv("SEARCH_MULTIPV", "2")),
+            )
+        self.ponder = os.getenv("PONDER", "false").lower() in ("1", "true", "yes")
+        self.metrics = Metrics()
+        self.startup = StartupTimer(self.log, self.metrics, self.STARTUP_PHASES)
         self.challenges = ChallengesHandler(self)
-        self._loops: "list[Loop]" = []
+        self.scheduler = Scheduler(self.log)
 
     async def setup(self):
-        self.session = aiohttp.ClientSession("https://lichess.org", headers=HEADERS)
-        _, self.engine = await chess.engine.popen_uci(os.getenv("ENGINE_PATH"))
+        self.setup_http()
+        self.setup_engines()
+        self.setup_profiling()
+        await self.setup_metrics()
+        self.setup_admission(self.engines.size)
+        self.setup_matchmaking()
+        await self.setup_search()
+        self.setup_archive()
+
+    def setup_http(self, share: float = 1):
+        """Opens the Lichess session, with `share` of the configured request rate."""
+        connector = aiohttp.TCPConnector(
+            limit=int(os.getenv("HTTP_CONNECTIONS", "100")),
+            keepalive_timeout=60,
+            ttl_dns_cache=300,
+        )
+        self.session = aiohttp.ClientSession(
+            os.getenv("LICHESS_URL", "https://lichess.org"),
+            headers=HEADERS,
+            connector=connector,
+        )
+        self.http = RequestScheduler(
+            self.session,
+            rate=float(os.getenv("HTTP_RATE", "8")) * share,
+            burst=max(1.0, float(os.getenv("HTTP_BURST", "16")) * share),
+            move_reserve=float(os.getenv("HTTP_MOVE_RESERVE", "2")) * share,
+            metrics=self.metrics,
+        )
+
+    def setup_engines(self):
+        """Creates the engine pool, which is started by `start`."""
+        self.engines = EnginePool(
+            os.getenv("ENGINE_PATH"),
+            self.log,
+            size=int(os.getenv("ENGINE_POOL_SIZE", "1")),
+            threads=int(os.getenv("ENGINE_THREADS", "0")),
+            hash_size=int(os.getenv("ENGINE_HASH", "0")),
+            profiles=load_profiles(os.getenv("ENGINE_PROFILES")),
+            warmup=float(os.getenv("ENGINE_WARMUP", "0.1")),
+        )
+        self.metrics.gauge(
+            "engines_idle", "Engines not leased by any game.", lambda: self.engines.idle
+        )
+        self.metrics.gauge(
+            "engines_queued",
+            "Games waiting for an engine.",
+            lambda: self.engines.queued,
+        )
+        self.metrics.counter(
+            "engine_reconfigurations_total",
+            "Engines switched to the profile of another game.",
+            lambda: self.engines.reconfigurations,
+        )
+        self.add_loop(Loop(self.engines.health_check, seconds=30))
+
+    async def setup_metrics(self):
+        self.metrics.gauge("games", "Games in progress.", lambda: len(self.games))
+        self.metrics.gauge(
+            "http_queued",
+            "Requests waiting for the rate limiter.",
+            lambda: self.http.queued,
+        )
+        if self.adjudicator is not None:
+            for adjudication in Adjudication:
+                self.metrics.counter(
+                    f"adjudication_{adjudication.value}_total",
+                    f"Games given the {adjudication.value} adjudication.",
+                    lambda adjudication=adjudication: self.adjudicator.decisions[
+                        adjudication
+                    ],
+                )
+        if self.search is not None:
+            self.metrics.counter(
+                "search_early_total",
+                "Searches stopped early on a stable or clearly best move.",
+                lambda: self.search.early,
+            )
+            self.metrics.counter(
+                "search_extended_total",
+                "Searches extended on a dropping score.",
+                lambda: self.search.extended,
+            )
+            self.metrics.counter(
+                "search_fallback_total",
+                "Searches the engine rejected and that were played with a plain search.",
+                lambda: self.search.fallbacks,
+            )
+            self.metrics.counter(
+                "search_saved_seconds_total",
+                "Budgeted search time not spent.",
+                lambda: self.search.saved,
+            )
+        if os.getenv("METRICS_PORT"):
+            await self.metrics.serve(
+                os.getenv("METRICS_HOST", "127.0.0.1"), int(os.getenv("METRICS_PORT"))
+            )
+        self.add_loop(
+            Loop(
+                self.log_metrics,
+                seconds=int(os.getenv("METRICS_SUMMARY_INTERVAL", "60")),
+            )
+        )
+
+    async def start(self):
+        """Starts the engines and warms up the Lichess connection.
+
+        Both run while the event stream connects, and challenges are only
+        accepted once the engines are ready.
+        """
+        await asyncio.gather(self.start_engines(), self.preconnect())
+        self.open_admission()
+
+    async def start_engines(self):
+        started = time.perf_counter() - self.startup.started
+        await self.engines.start()
+        self.startup.done(
+            "engines",
+            started,
+            ", ".join(
+                f"{phase} {seconds:.3f}s"
+                for phase, seconds in self.engines.startup.items()
+            ),
+        )
+
+    async def preconnect(self):
+        """Resolves and connects to Lichess ahead of the first move, and fetches the account."""
+        started = time.perf_counter() - self.startup.started
+        try:
+            user_id = await self.challenges.account_id()
+        except aiohttp.ClientError as e:
+            self.log.warning("Failed to connect to Lichess: %s", e)
+            return
+        if user_id is not None:
+            self.log.info("Logged in as %s", user_id)
+            if self.matchmaker is not None:
+                self.matchmaker.user_id = user_id
+        self.startup.done("preconnect", started)
+
+    def open_admission(self):
+        self.admission.ready = True
+        self.log.info("Accepting challenges")
+        task = asyncio.create_task(self.challenges.process_queue())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def setup_profiling(self):
+        """Watches the event loop for stalls and profiles on SIGUSR1 or `/profile`."""
+        threshold = float(os.getenv("LOOP_LAG_THRESHOLD", "0.1"))
+        if threshold > 0:
+            self.monitor = LoopMonitor(
+                self.log,
+                self.metrics,
+                threshold=threshold,
+                debug=os.getenv("LOOP_DEBUG", "false").lower() in ("1", "true", "yes"),
+            )
+            self.monitor.start()
+            self.metrics.counter(
+                "loop_stalls_total",
+                "Times the event loop was blocked for longer than the threshold.",
+                lambda: self.monitor.stalls,
+            )
+            self.metrics.counter(
+                "loop_slow_callbacks_total",
+                "Callbacks that ran longer than the threshold, in loop debug mode.",
+                lambda: self.monitor.slow_callbacks,
+            )
+        self.profiler = SamplingProfiler(
+            os.getenv("PROFILE_PATH", "profiles"),
+            self.log,
+            interval=float(os.getenv("PROFILE_INTERVAL", "0.005")),
+        )
+        self.metrics.route("/profile", self._handle_profile)
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGUSR1, self._on_profile_signal
+            )
+        except (AttributeError, NotImplementedError):
+            # No SIGUSR1 on Windows, the endpoint still works
+            pass
+
+    def _on_profile_signal(self):
+        seconds = float(os.getenv("PROFILE_SECONDS", "30"))
+        task = asyncio.create_task(self.profiler.profile(seconds))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle_profile(self, request: web.Request) -> web.Response:
+        try:
+            seconds = float(
+                request.query.get("seconds", os.getenv("PROFILE_SECONDS", "30"))
+            )
+        except ValueError:
+            return web.Response(status=400, text="seconds must be a number")
+        if not 0 < seconds <= 600:
+            return web.Response(status=400, text="seconds must be in (0, 600]")
+        profile = await self.profiler.profile(seconds)
+        if profile is None:
+            return web.Response(status=409, text="A profile is already being taken")
+        return web.Response(text=profile, content_type="text/plain")
+
+    def setup_admission(self, capacity: int):
+        """Admits challenges for `capacity` engines."""
+        self.admission = AdmissionController(
+            capacity,
+            self.games,
+            max_games=int(os.getenv("MAX_GAMES", "0")),
+            max_load=float(os.getenv("MAX_ENGINE_LOAD", "1")),
+            queue_size=int(os.getenv("CHALLENGE_QUEUE_SIZE", "4")),
+            queue_timeout=float(os.getenv("CHALLENGE_QUEUE_TIMEOUT", "20")),
+            min_duration=float(os.getenv("MIN_GAME_DURATION", "0")),
+            max_duration=float(os.getenv("MAX_GAME_DURATION", "0")),
+        )
+        self.metrics.gauge(
+            "admission_queue",
+            "Challenges waiting for engine capacity.",
+            lambda: len(self.admission.queue),
+        )
+        self.metrics.gauge(
+            "admission_load",
+            "Estimated engine utilisation of the admitted games.",
+            lambda: self.admission.utilisation,
+        )
+        for decision in AdmissionDecision:
+            self.metrics.counter(
+                f"admission_{decision.value}_total",
+                f"Challenges given the {decision.value} decision.",
+                lambda decision=decision: self.admission.decisions[decision],
+            )
+        self.add_loop(Loop(self.challenges.process_queue, seconds=5))
+
+    def setup_matchmaking(self):
+        """Challenges online bots while there is capacity left, if enabled."""
+        if os.getenv("MATCHMAKING", "false").lower() not in ("1", "true", "yes"):
+            return
+        self.matchmaker = Matchmaker(
+            self.challenges,
+            self.admission,
+            BotDirectory(
+                self.http, self.log, ttl=float(os.getenv("ONLINE_BOTS_TTL", "600"))
+            ),
+            self.log,
+            clocks=parse_clocks(
+                os.getenv(
+                    "MATCHMAKING_CLOCKS", "2+0,5+0,5+3,10+0,10+5,15+0,15+5,30+0,30+10"
+                )
+            ),
+            timeout=float(os.getenv("MATCHMAKING_TIMEOUT", "60")),
+            cooldown=float(os.getenv("MATCHMAKING_COOLDOWN", "300")),
+            rematch_cooldown=float(os.getenv("MATCHMAKING_REMATCH_COOLDOWN", "1800")),
+        )
+        self.metrics.counter(
+            "matchmaking_sent_total",
+            "Challenges sent to online bots.",
+            lambda: self.matchmaker.sent,
+        )
+        self.metrics.counter(
+            "matchmaking_accepted_total",
+            "Challenges sent that were accepted.",
+            lambda: self.matchmaker.accepted,
+        )
+        self.metrics.counter(
+            "matchmaking_declined_total",
+            "Challenges sent that were declined, canceled or failed.",
+            lambda: self.matchmaker.declined,
+        )
+        self.add_loop(
+            Loop(
+                self.matchmaker.run,
+                seconds=float(os.getenv("MATCHMAKING_INTERVAL", "30")),
+            )
+        )
+
+    async def setup_search(self):
+        if int(os.getenv("EVAL_CACHE_SIZE", "100000")) > 0:
+            self.eval_cache = EvalCache(
+                int(os.getenv("EVAL_CACHE_SIZE", "100000")),
+                os.getenv("EVAL_CACHE_PATH"),
+            )
+            await self.eval_cache.load()
+            self.add_loop(Loop(self.eval_cache.flush, seconds=30))
+        if os.getenv("BOOK_PATH"):
+            self.book = OpeningBook(
+                os.getenv("BOOK_PATH"),
+                max_depth=int(os.getenv("BOOK_DEPTH", "20")),
+                selection=os.getenv("BOOK_SELECTION", "weighted"),
+            )
+        if os.getenv("SYZYGY_PATH"):
+            self.tablebase = Tablebase(
+                os.getenv("SYZYGY_PATH"),
+                max_pieces=int(os.getenv("SYZYGY_MAX_PIECES", "6")),
+                cache_size=int(os.getenv("SYZYGY_CACHE_SIZE", "4096")),
+            )
+
+    def setup_archive(self, prefix: str = "games"):
+        if not os.getenv("ARCHIVE_PATH"):
+            return
+        self.archive = GameArchive(
+            os.getenv("ARCHIVE_PATH"),
+            format=os.getenv("ARCHIVE_FORMAT", "ndjson"),
+            max_size=int(os.getenv("ARCHIVE_MAX_SIZE", "64")) * 1024 * 1024,
+            prefix=prefix,
+        )
+        self.metrics.counter(
+            "archived_games_total",
+            "Games written to the archive.",
+            lambda: self.archive.written,
+        )
+        self.add_loop(Loop(self.archive.flush, seconds=10))
+
+    def start_game(self, game: Game, load: float):
+        handler = GameStreamHandler(self, game, ponder=self.ponder)
+        self.games.add(handler, load)
+
+    async def game_finished(self, game_id: str, stats: "dict[str, object]"):
+        if stats:
+            self.log.debug(
+                "Stats for game %s: %s", game_id, stats, extra={"game": game_id}
+            )
+        await self.challenges.process_queue()
+
+    async def log_metrics(self):
+        summary = self.metrics.summary()
+        if summary:
+            self.log.info("Latency summary: %s", summary)
+
+    async def close(self):
+        if self.monitor is not None:
+            self.monitor.stop()
+        await self.scheduler.stop()
+        await self.games.shutdown()
+        await self.metrics.close()
+        if self.book is not None:
+            self.book.close()
+        if self.tablebase is not None:
+            self.tablebase.close()
+        if self.eval_cache is not None:
+            await self.eval_cache.close()
+        if self.archive is not None:
+            await self.archive.close()
+        if hasattr(self, "engines"):
+            await self.engines.close()
+        if hasattr(self, "session"):
+            self.http.close()
+            await self.session.close()
 
     def add_loop(self, loop: Loop):
-        self._loops.append(loop)
+        self.scheduler.add(loop)
 
     def main(self, coro: Coroutine):
         self.call = AppMainFunction(coro)
@@ -66,11 +485,20 @@ class App:
         except (KeyboardInterrupt, SystemExit):
             self.log.info("App shutting down")
         finally:
+            loop.run_until_complete(self.close())
             loop.close()
+            self.log.close()
 
     async def _run(self):
         await self.setup()
-        await asyncio.gather(self.call(), *[l.start() for l in self._loops])  # TODO
+        self.scheduler.start()
+        main = asyncio.create_task(self.call())
+        try:
+            await self.start()
+        except BaseException:
+            main.cancel()
+            raise
+        await main
 
     def loop(
         self,
@@ -78,7 +506,7 @@ class App:
         seconds: int = 0,
         minutes: int = 0,
         hours: int = 0,
-        sleep_interval: int = 3,
+        overrun: str = "skip",
     ):
         def decorator(func: Coroutine):
             loop = Loop(
@@ -86,7 +514,7 @@ class App:
                 seconds=seconds,
                 minutes=minutes,
                 hours=hours,
-                sleep_interval=sleep_interval,
+                overrun=overrun,
             )
             self.add_loop(loop)
             return loop
@@ -98,26 +526,32 @@ class ChallengesHandler:
     def __init__(self, app: App):
         self.app = app
 
-    async def send_challenge(self, user: BotUser):
-        self.app.log.info("Sending challenge to %s", user.username)
-        clock = choice(
-            [
-                (2, 0),
-                (5, 0),
-                (5, 3),
-                (10, 0),
-                (10, 5),
-                (15, 0),
-                (15, 5),
-                (30, 0),
-                (30, 10),
-            ]
-        )
-        r = await self.app.session.post(
+    async def account_id(self) -> Optional[str]:
+        r = await self.app.http.get("/api/account", RequestPriority.HOUSEKEEPING)
+        if r.status != 200:
+            self.app.log.warning(
+                "Failed to fetch the account. Error code: %s", r.status
+            )
+            return None
+        return (await r.json())["id"]
+
+    async def send_challenge(
+        self, user: BotUser, clock: "tuple[int, int]"
+    ) -> Optional[str]:
+        """Challenges a user with a clock of (limit, increment) in seconds.
+
+        Returns the ID of the challenge, or None if it was not sent.
+        """
+        self.app.log.info(
+            "Sending challenge to %s, %s+%s", user.username, clock[0] // 60, clock[1]
+        )
+        r = await self.app.http.post(
             f"/api/challenge/{user.username}",
+            RequestPriority.CHALLENGE,
             json={
-                "rated": True,
-                "clock.limit": clock[0] * 60,
+                "rated": os.getenv("MATCHMAKING_RATED", "true").lower()
+                in ("1", "true", "yes"),
+                "clock.limit": clock[0],
                 "clock.increment": clock[1],
             },
         )
@@ -127,12 +561,60 @@ class ChallengesHandler:
                 user.username,
                 r.status,
             )
+            return None
+        data = await r.json()
+        return data.get("challenge", data)["id"]
+
+    async def cancel_challenge(self, challenge_id: str):
+        await self.app.http.post(
+            f"/api/challenge/{challenge_id}/cancel", RequestPriority.CHALLENGE
+        )
+
+    async def accept_challenge(self, challenge_id: str) -> bool:
+        r = await self.app.http.post(
+            f"/api/challenge/{challenge_id}/accept", RequestPriority.CHALLENGE
+        )
+        if r.status != 200:
+            self.app.log.warning(
+                "Failed to accept challenge %s. Error code: %s", challenge_id, r.status
+            )
+            self.app.admission.release(challenge_id)
+            return False
+        return True
+
+    async def decline_challenge(
+        self, challenge_id: str, reason: DeclineReason = DeclineReason.GENERIC
+    ):
+        await self.app.http.post(
+            f"/api/challenge/{challenge_id}/decline",
+            RequestPriority.CHALLENGE,
+            data={"reason": reason.value},
+        )
+
+    async def process_queue(self):
+        """Accepts queued challenges that fit and declines the expired ones."""
+        try:
+            for challenge in self.app.admission.expire():
+                self.app.log.info("Queued challenge %s expired", challenge.id)
+                await self.decline_challenge(challenge.id, DeclineReason.LATER)
+            for challenge in self.app.admission.drain():
+                self.app.log.info("Accepting queued challenge %s", challenge.id)
+                await self.accept_challenge(challenge.id)
+        except aiohttp.ClientError as e:
+            self.app.log.warning("Failed to process the challenge queue: %s", e)
 
 
 class StreamHandler:
+    RATE_LIMIT_DELAY = 60
+    PRIORITY = RequestPriority.STREAM
+    MAX_FAILURES = 10
+
     def __init__(self, app: App, endpoint: str):
         self.app = app
         self.stream = None
+        self.backoff = Backoff()
+        # When the chunk that completed the event being handled arrived
+        self.received = 0.0
         self._endpoint = endpoint
 
     async def connect(self):
@@ -141,210 +623,504 @@ class StreamHandler:
             self.app.session._base_url,
             self._endpoint,
         )
-        r = await self.app.session.get(self._endpoint)
+        r = await self.app.http.get(self._endpoint, self.PRIORITY, stream=True)
         if r.status != 200:
-            raise ConnectionFailure(r.status, await r.json())
+            retry_after = r.headers.get("Retry-After")
+            if retry_after is not None and retry_after.isdigit():
+                retry_after = float(retry_after)
+            elif r.status == 429:
+                # Lichess asks clients to wait a full minute after a 429
+                retry_after = self.RATE_LIMIT_DELAY
+            else:
+                retry_after = None
+            raise ConnectionFailure(r.status, await r.text(), retry_after)
 
         self.stream = r.content
         self.app.log.info(Color.colorize("CONNECTED SUCCESSFULLY", Color.GREEN))
 
+    async def listen(self):
+        """Handles the stream until it is finished, reconnecting with backoff when it drops."""
+        failures = 0
+        while True:
+            retry_after = None
+            try:
+                await self.connect()
+                if await self._handle_events():
+                    return
+                self.app.log.warning(
+                    "Stream %s was closed by the server", self._endpoint
+                )
+            except ConnectionFailure as e:
+                if not e.retryable:
+                    self.app.log.error("Giving up on stream %s: %s", self._endpoint, e)
+                    return
+                self.app.log.warning("%s", e)
+                retry_after = e.retry_after
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.app.log.warning(
+                    "Stream %s disconnected: %s", self._endpoint, repr(e)
+                )
+            except Exception as e:
+                self.app.log.exception(
+                    "Unknown exception in stream %s: %s", self._endpoint, e
+                )
+                failures += 1
+                if failures >= self.MAX_FAILURES:
+                    return
+
+            delay = self.backoff.next_delay(retry_after)
+            self.app.log.warning(
+                "Reconnecting to %s in %.1f seconds...", self._endpoint, delay
+            )
+            await asyncio.sleep(delay)
+
+    async def events(self) -> "AsyncIterator[dict[str, Any]]":
+        """Yields the events of the connected stream."""
+        async for data in iter_ndjson(
+            self.stream, self._on_decode_error, self.app.metrics, self._on_chunk
+        ):
+            # A reconnect that delivers events worked, however soon it drops again
+            self.backoff.reset()
+            yield data
+
+    async def _handle_events(self) -> bool:
+        """Handles the events of a connected stream and returns True once it is finished."""
+        raise NotImplementedError
+
+    def _on_chunk(self):
+        self.received = time.perf_counter()
+
+    def _on_decode_error(self, raw_data: bytes):
+        self.app.log.warning("Failed to decode JSON: %s", raw_data)
+
 
 class APIStreamHandler(StreamHandler):
     def __init__(self, app: App):
         super().__init__(app, "/api/stream/event")
-        self.tasks: "set[asyncio.Task]" = set()
+
+    async def connect(self):
+        started = time.perf_counter() - self.app.startup.started
+        await super().connect()
+        self.app.startup.done("stream", started)
 
     async def begin_listening(self):
-        await self.connect()
-        while True:
-            try:
-                await self._handle_events()
-            except (aiohttp.ServerDisconnectedError, asyncio.TimeoutError):
-                self.app.log.warning("Server disconnected, reconnecting...")
-                await self.connect()
-            except Exception as e:
-                self.app.log.error("Unknown exception: %s", e)
-                s = StringIO()
-                traceback.print_exception(type(e), e, e.__traceback__, file=s)
-                print(s.getvalue())
-                break
+        await self.listen()
 
-    async def _handle_events(self):
+    async def _handle_events(self) -> bool:
         try:
-            async for raw_data in self.stream.iter_any():
-                decoded = raw_data.decode()
-                if decoded == "\n" or decoded == "\n\n":
-                    continue
-
-                try:
-                    data_ls = decode_json(raw_data)
-                except JSONDecodeFailure:
-                    self.app.log.warning("Failed to decode JSON: %s", raw_data)
+            async for data in self.events():
+                event = APIEvent.from_json(data)
+                if event is None:
+                    self.app.log.warning(
+                        "Received unhandled event: %s",
+                        data["type"],
+                        extra={"event": data["type"]},
+                    )
                     continue
 
-                for data in data_ls:
-                    event = APIEvent.from_json(data)
-                    if event is None:
-                        self.app.log.warning(
-                            "Received unhandled event: %s", data["type"]
-                        )
+                if event.type == EventType.CHALLENGE:
+                    if self.app.matchmaker is not None and self.app.matchmaker.owns(
+                        event.challenge
+                    ):
                         continue
-
-                    if event.type == EventType.CHALLENGE:
+                    self.app.log.info(
+                        "Received a challenge, ID: %s",
+                        event.challenge.id,
+                        extra={"event": event.type.value},
+                    )
+                    decision, reason = self.app.admission.decide(event.challenge)
+                    if decision == AdmissionDecision.ACCEPT:
+                        await self.accept_challenge(event.challenge.id)
+                    elif decision == AdmissionDecision.QUEUE:
                         self.app.log.info(
-                            "Received a challenge, ID: %s", event.challenge.id
+                            "Queued challenge %s, %s challenge(s) waiting",
+                            event.challenge.id,
+                            len(self.app.admission.queue),
                         )
-                        # Currently only accepting standart
-                        if event.challenge.variant == Variant.STANDARD:
-                            await self.accept_challenge(event.challenge.id)
-                        else:
-                            await self.decline_challenge(event.challenge.id)
-
-                    elif (
-                        event.type == EventType.GAME_START
-                        and not event.game.id in self.app.games
-                    ):
-                        self.app.log.info("Starting a game, ID: %s", event.game.id)
-                        game_handler = GameStreamHandler(self.app, event.game)
-                        task = asyncio.create_task(game_handler.play())
-                        task.add_done_callback(self.tasks.discard)
-                        self.tasks.add(task)
+                    else:
+                        self.app.log.info(
+                            "Declining challenge %s: %s",
+                            event.challenge.id,
+                            reason.value,
+                        )
+                        await self.decline_challenge(event.challenge.id, reason)
+
+                elif event.type in (
+                    EventType.CHALLENGE_CANCELED,
+                    EventType.CHALLENGE_DECLINED,
+                ):
+                    self.app.admission.cancel(event.challenge.id)
+                    if self.app.matchmaker is not None:
+                        self.app.matchmaker.on_declined(event.challenge)
+
+                elif (
+                    event.type == EventType.GAME_START
+                    and not event.game.id in self.app.games
+                ):
+                    self.app.log.info(
+                        "Starting a game, ID: %s",
+                        event.game.id,
+                        extra={"game": event.game.id, "event": event.type.value},
+                    )
+                    if self.app.matchmaker is not None:
+                        self.app.matchmaker.on_game_start(event.game)
+                    self.app.start_game(
+                        event.game, self.app.admission.claim(event.game.id)
+                    )
         except asyncio.CancelledError:
-            for task in self.tasks:
-                task.cancel()
+            await self.app.games.shutdown()
+            raise
+        return False
 
     async def accept_challenge(self, challenge_id: str):
-        await self.app.session.post(f"/api/challenge/{challenge_id}/accept")
+        await self.app.challenges.accept_challenge(challenge_id)
 
-    async def decline_challenge(self, challenge_id: str):
-        await self.app.session.post(f"/api/challenge/{challenge_id}/decline")
+    async def decline_challenge(
+        self, challenge_id: str, reason: DeclineReason = DeclineReason.GENERIC
+    ):
+        await self.app.challenges.decline_challenge(challenge_id, reason)
 
 
 class GameStreamHandler(StreamHandler):
-    def __init__(self, app, game: Game):
+    PRIORITY = RequestPriority.GAME_STREAM
+
+    def __init__(self, app, game: Game, ponder: bool = False):
         super().__init__(app, f"/api/bot/game/stream/{game.id}")
         self.game = game
-        self.board = chess.Board()
+        self.sync = BoardSynchronizer()
+        self.board = self.sync.board
         self.moves = ""
+        self.in_book = app.book is not None
+        self.budgets: "list[MoveBudget]" = []
+        self.profile = app.engines.profile(game.speed)
+        # Moves of a skill-limited engine are weakened on purpose, so they are not shared
+        self.eval_cache = app.eval_cache if self.profile.skill is None else None
+        self.ponderer = (
+            Ponderer(app.engines, game.id, app.log, self.profile) if ponder else None
+        )
+        self.extra = {"game": game.id}
+        self.started_at = time.time()
+        self.clocks: "list[tuple[int, int, int]]" = []
+        self.turn_received = 0.0
+        self.search_stats: "list[dict[str, object]]" = []
+        self.status: Optional[GameStatus] = None
+        self.winner: Optional[str] = None
+        self.scores: "list[int]" = []
+        self.last_draw_offer: Optional[int] = None
+        self.draw_answered: Optional[int] = None
 
     async def play(self):
-        self.app.games.append(self.game.id)
-        await self.connect()
-        while True:
-            try:
-                async for raw_data in self.stream.iter_any():
-                    decoded = raw_data.decode()
-                    if decoded == "\n" or decoded == "\n\n":
-                        continue
+        try:
+            await self.listen()
+        finally:
+            if self.ponderer is not None:
+                self.ponderer.cancel()
+            self.app.engines.forget(self.game.id)
+            if self.app.archive is not None and self.status is not None:
+                self.app.archive.add(game_record(self, self.status.value, self.winner))
+            entry = self.app.games.remove(self.game.id)
+            await self.app.game_finished(
+                self.game.id, entry.stats() if entry is not None else {}
+            )
 
-                    try:
-                        data_ls = decode_json(raw_data)
-                    except JSONDecodeFailure:
-                        self.app.log.warning("Failed to decode JSON: %s", raw_data)
-                        continue
+    async def _handle_events(self) -> bool:
+        async for data in self.events():
+            event = APIEvent.from_json(data)
+            if event is None:
+                self.app.log.warning(
+                    "Received unhandled event for game %s: %s",
+                    self.game.id,
+                    data["type"],
+                    extra={"game": self.game.id, "event": data["type"]},
+                )
+                continue
 
-                    for data in data_ls:
-                        event = APIEvent.from_json(data)
-                        if event is None:
-                            self.app.log.warning(
-                                "Received unhandled event for game %s: %s",
-                                self.game.id,
-                                data["type"],
-                            )
-                            continue
-
-                        if event.type == EventType.GAME_STATE:
-                            if event.status != GameStatus.STARTED:
-                                self.app.log.info(
-                                    "The game %s finished with status %s",
-                                    self.game.id,
-                                    str(event.status),
-                                )
-                                try:
-                                    self.app.games.remove(self.game.id)
-                                except:
-                                    pass
-                                return
-                            await self.on_game_state(event)
-
-                        elif event.type == EventType.GAME_START:
-                            self.app.log.info("The game %s has started", self.game.id)
-
-            except (aiohttp.ServerDisconnectedError, asyncio.TimeoutError):
-                self.app.log.warning("Server disconnected, reconnecting...")
-                await self.connect()
-            except Exception as e:
-                self.app.log.error("Unknown exception: %s", e)
-                s = StringIO()
-                traceback.print_exception(type(e), e, e.__traceback__, file=s)
-                print(s.getvalue())
-                break
-
-    async def take_turn(self, wtime: int, btime: int, winc: int, binc: int, first_turn: bool = False):
-        move: chess.Move = (
-            await self.app.engine.play(
-                self.board,
-                chess.engine.Limit(
-                    time=10 if first_turn else None,
-                    white_clock=wtime / 1000,
-                    black_clock=btime / 1000,
-                    white_inc=winc / 1000,
-                    black_inc=binc / 1000,
-                ),
-            )
-        ).move
+            if event.type in (EventType.GAME_STATE, EventType.GAME_FULL):
+                if event.status != GameStatus.STARTED:
+                    # The last move may have ended the game, so it is only in this event
+                    self.sync_state(event)
+                    self.status = event.status
+                    self.winner = event.winner
+                    self.app.log.info(
+                        "The game %s finished with status %s",
+                        self.game.id,
+                        event.status,
+                        extra={"game": self.game.id, "event": event.type.value},
+                    )
+                    return True
+                if event.type == EventType.GAME_FULL and self.sync.pending > 0:
+                    # A move we pushed locally never reached the server
+                    self.moves = event.moves
+                    self.revalidate()
+                await self.on_game_state(event)
+
+            elif event.type == EventType.GAME_START:
+                self.app.log.info(
+                    "The game %s has started",
+                    self.game.id,
+                    extra={"game": self.game.id, "event": event.type.value},
+                )
+        return False
+
+    async def take_turn(self, wtime: int, btime: int, winc: int, binc: int):
+        if self.game.color == GameColor.WHITE:
+            clock, inc = wtime, winc
+        else:
+            clock, inc = btime, binc
+        budget = self.app.time_manager.allocate(
+            clock, inc, self.board.ply(), self.game.variant
+        )
+        self.budgets.append(budget)
+        turn_started = time.perf_counter()
+
+        result = None
+        source = "engine"
+        if self.in_book:
+            with self.app.metrics.span("book_probe"):
+                book_move = self.app.book.probe(self.board)
+            if book_move is not None:
+                result = chess.engine.PlayResult(book_move, None)
+                source = "book"
+            else:
+                self.app.log.debug(
+                    "Game %s left the opening book", self.game.id, extra=self.extra
+                )
+                self.in_book = False
+
+        if result is None and self.app.tablebase is not None:
+            with self.app.metrics.span("tablebase_probe"):
+                tablebase_move = await self.app.tablebase.probe(self.board)
+            if tablebase_move is not None:
+                result = chess.engine.PlayResult(tablebase_move, None)
+                source = "tablebase"
+                if self.ponderer is not None:
+                    self.ponderer.cancel()
+
+        if result is None and self.eval_cache is not None:
+            cached = self.eval_cache.lookup(self.board, budget.time)
+            if cached is not None:
+                result = chess.engine.PlayResult(
+                    cached.move, cached.ponder, {"depth": cached.depth}
+                )
+                if cached.score is not None:
+                    result.info["score"] = chess.engine.PovScore(
+                        cached.score, self.board.turn
+                    )
+                source = "cache"
+                if self.ponderer is not None:
+                    self.ponderer.cancel()
+
+        if result is None and self.ponderer is not None:
+            with self.app.metrics.span("ponder_resolve"):
+                pondered = await self.ponderer.resolve(self.board, min_time=budget.time)
+            if pondered is not None:
+                result = pondered
+                source = "ponder"
+                if self.eval_cache is not None:
+                    self.eval_cache.put(self.board, result)
+
+        if result is None:
+            searched = time.perf_counter()
+            with self.app.metrics.span("engine_search"):
+                async with self.app.engines.lease(self.game.id, self.profile) as engine:
+                    if self.app.search is not None:
+                        result, reason = await self.app.search.play(
+                            engine,
+                            self.board,
+                            budget,
+                            depth=self.profile.depth,
+                            nodes=self.profile.nodes,
+                            game=self.game.id,
+                        )
+                        self.app.log.debug(
+                            "Game %s: search stopped after %.3fs (%s)",
+                            self.game.id,
+                            time.perf_counter() - searched,
+                            reason,
+                            extra=self.extra,
+                        )
+                    else:
+                        result = await engine.play(
+                            self.board,
+                            self.profile.limit(budget.time),
+                            game=self.game.id,
+                            info=chess.engine.INFO_BASIC
+                            | chess.engine.INFO_SCORE
+                            | chess.engine.INFO_PV,
+                        )
+            if self.eval_cache is not None:
+                self.eval_cache.put(self.board, result, time.perf_counter() - searched)
+        move: chess.Move = result.move
+        self.record_search(move, source, budget, result.info, turn_started)
+
+        adjudication = None
+        if self.app.adjudicator is not None:
+            score = self.app.adjudicator.score(result.info)
+            if score is not None:
+                self.scores.append(score)
+            adjudication = self.app.adjudicator.decide(
+                self.scores, self.board.ply(), self.last_draw_offer
+            )
+            if adjudication == Adjudication.RESIGN:
+                await self.resign()
+                return
+
+        self.app.log.info(
+            "Game %s ply %s: playing %s, %s",
+            self.game.id,
+            self.board.ply(),
+            move.uci(),
+            budget,
+            extra=self.extra,
+        )
         self.push(move)
 
-        r = await self.app.session.post(
-            f"/api/bot/game/{self.game.id}/move/{move.uci()}"
+        params = {}
+        if adjudication == Adjudication.OFFER_DRAW:
+            self.app.log.info(
+                "Offering a draw in game %s", self.game.id, extra=self.extra
+            )
+            self.last_draw_offer = self.board.ply()
+            params["offeringDraw"] = "true"
+
+        started = time.perf_counter()
+        r = await self.app.http.post(
+            f"/api/bot/game/{self.game.id}/move/{move.uci()}",
+            RequestPriority.MOVE,
+            params=params,
+        )
+        latency = time.perf_counter() - started
+        self.app.time_manager.record_latency(latency)
+        self.app.metrics.observe("move_post", latency)
+        self.app.metrics.observe(
+            "event_to_move", time.perf_counter() - self.turn_received
         )
         if r.status != 200:
             self.app.log.warning(
-                "Invalid move sent to game %s, revalidating...", self.game.id
+                "Invalid move sent to game %s, revalidating...",
+                self.game.id,
+                extra=self.extra,
             )
             self.revalidate()
             await self.take_turn(wtime, btime, winc, binc)
+        elif self.ponderer is not None:
+            await self.ponderer.start(self.board, result.ponder)
 
-    async def on_game_state(self, event: GameStateEvent):
+    @property
+    def is_my_turn(self) -> bool:
+        return self.sync.pending == 0 and self.board.turn == (
+            self.game.color == GameColor.WHITE
+        )
+
+    def record_search(
+        self,
+        move: chess.Move,
+        source: str,
+        budget: MoveBudget,
+        info: chess.engine.InfoDict,
+        started: float,
+    ):
+        stats = {
+            "ply": self.board.ply(),
+            "move": move.uci(),
+            "source": source,
+            "budget": round(budget.time, 3),
+            "elapsed": round(time.perf_counter() - started, 3),
+            "depth": info.get("depth"),
+        }
+        if "score" in info:
+            score = info["score"].relative
+            stats["cp"] = score.score()
+            stats["mate"] = score.mate()
+        self.search_stats.append(stats)
+
+    def sync_state(self, event: GameStateEvent):
+        """Syncs the board and records the clocks of a game state."""
         self.moves = event.moves
-        if self.game.color == GameColor.WHITE and not self.game.has_moved:
-            self.app.log.debug("Playing as white so doing a turn")
-            self.game.has_moved = True
-            await self.take_turn(event.wtime, event.btime, event.winc, event.binc, first_turn=True)
-        if len(self.board.move_stack) == 0 and len(self.moves.split()) != 0:
+        try:
+            with self.app.metrics.span("board_sync"):
+                self.sync.sync(self.moves)
+        except ValueError:
             self.app.log.warning(
-                "Received a GAME_STATE event but there were \
-no moves detected on local board, revalidating..."
+                "Failed to apply moves to local game %s, revalidating...",
+                self.game.id,
+                extra=self.extra,
             )
             self.revalidate()
+        ply = self.board.ply() - self.sync.pending
+        if not self.clocks or self.clocks[-1][0] != ply:
+            self.clocks.append((ply, event.wtime, event.btime))
 
-        try:
-            server_last_move = self.moves.split()[-1]
-            local_last_move = self.board.move_stack[-1].uci()
-        except:
-            return
+    async def on_game_state(self, event: GameStateEvent):
+        self.turn_received = self.received
+        self.sync_state(event)
+        ply = self.board.ply() - self.sync.pending
+        offered = event.bdraw if self.game.color == GameColor.WHITE else event.wdraw
+        if offered and self.app.adjudicator is not None and self.draw_answered != ply:
+            self.draw_answered = ply
+            answer = self.app.adjudicator.answer_draw(self.scores, ply)
+            await self.answer_draw(answer == Adjudication.ACCEPT_DRAW)
+            if answer == Adjudication.ACCEPT_DRAW:
+                return
 
-        if (
-            server_last_move != local_last_move
-            or (self.game.color == GameColor.WHITE and len(self.moves.split()) % 2 == 0)
-            or (self.game.color == GameColor.BLACK and len(self.moves.split()) % 2 != 0)
-        ):
-            self.push(chess.Move.from_uci(server_last_move))
-            await self.take_turn(event.wtime, event.btime, event.winc, event.binc)
+        if self.is_my_turn and not self.board.is_game_over():
+            with self.app.metrics.span("turn"):
+                await self.take_turn(event.wtime, event.btime, event.winc, event.binc)
 
-    def revalidate(self):
-        self.app.log.info("Revalidation started")
-        self.board = chess.Board()
-        for move in self.moves.split():
-            self.board.push_uci(move)
+    async def resign(self):
+        self.app.log.info(
+            "Resigning game %s at ply %s with score %s",
+            self.game.id,
+            self.board.ply(),
+            self.scores[-1],
+            extra=self.extra,
+        )
+        r = await self.app.http.post(
+            f"/api/bot/game/{self.game.id}/resign", RequestPriority.MOVE
+        )
+        if r.status != 200:
+            self.app.log.warning(
+                "Failed to resign game %s. Error code: %s",
+                self.game.id,
+                r.status,
+                extra=self.extra,
+            )
 
-        self.app.log.info("Revalidation finished. Revalidated moves: %s", self.moves)
+    async def answer_draw(self, accept: bool):
+        self.app.log.info(
+            "%s the draw offer in game %s",
+            "Accepting" if accept else "Declining",
+            self.game.id,
+            extra=self.extra,
+        )
+        r = await self.app.http.post(
+            f"/api/bot/game/{self.game.id}/draw/{'yes' if accept else 'no'}",
+            RequestPriority.MOVE,
+        )
+        if r.status != 200:
+            self.app.log.warning(
+                "Failed to answer the draw offer in game %s. Error code: %s",
+                self.game.id,
+                r.status,
+                extra=self.extra,
+            )
+
+    def revalidate(self):
+        self.app.log.info(
+            "Revalidation of game %s started", self.game.id, extra=self.extra
+        )
+        self.sync.replay(self.moves)
+        self.app.log.info(
+            "Revalidation finished. Revalidated moves: %s", self.moves, extra=self.extra
+        )
 
     def push(self, move: chess.Move):
-        try:
-            self.board.push(move)
-        except AssertionError:
+        if not self.board.is_legal(move):
             self.app.log.warning(
-                "Invalid move submitted to local game %s, revalidating...", self.game.id
+                "Invalid move submitted to local game %s, revalidating...",
+                self.game.id,
+                extra=self.extra,
             )
             self.revalidate()
+            return
+        self.board.push(move)
@@ -0,0 +1,293 @@
+import asyncio
+import gzip
+import io
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Iterator, Optional, Union
+
+import chess
+import chess.pgn
+
+from utils import decode_json
+
+FORMATS = ("ndjson", "pgn")
+RESULTS = {"white": "1-0", "black": "0-1"}
+
+
+def game_result(record: dict) -> str:
+    if record["winner"] is not None:
+        return RESULTS[record["winner"]]
+    if record["status"] in ("draw", "stalemate"):
+        return "1/2-1/2"
+    return "*"
+
+
+def to_pgn(record: dict) -> str:
+    """Renders a game record as PGN, with clocks and our search stats as comments."""
+    game = chess.pgn.Game()
+    started = datetime.fromtimestamp(record["started"], timezone.utc)
+    game.headers["Event"] = "Lichess bot game"
+    game.headers["Site"] = f"https://lichess.org/{record['id']}"
+    game.headers["Date"] = started.strftime("%Y.%m.%d")
+    opponent = record.get("opponent") or "?"
+    if record["color"] == "white":
+        game.headers["White"], game.headers["Black"] = "hermes", opponent
+    else:
+        game.headers["White"], game.headers["Black"] = opponent, "hermes"
+    game.headers["Result"] = game_result(record)
+    game.headers["Termination"] = record["status"]
+    if record["variant"] != "standard":
+        game.headers["Variant"] = record["variant"]
+
+    clocks = {ply: (wtime, btime) for ply, wtime, btime in record["clocks"]}
+    search = {stats["ply"]: stats for stats in record["search"]}
+    node = game
+    for ply, uci in enumerate(record["moves"]):
+        node = node.add_variation(chess.Move.from_uci(uci))
+        if ply + 1 in clocks:
+            # The clock of the side that just moved
+            node.set_clock(clocks[ply + 1][ply % 2] / 1000)
+        stats = search.get(ply)
+        if stats is not None:
+            comment = f"{stats['source']} {stats['elapsed']:.2f}s"
+            if stats.get("depth") is not None:
+                comment += f" d{stats['depth']}"
+            if stats.get("mate") is not None:
+                comment += f" #{stats['mate']}"
+            elif stats.get("cp") is not None:
+                comment += f" {stats['cp'] / 100:+.2f}"
+            node.comment = f"{node.comment} {comment}".strip()
+    return str(game) + "\n\n"
+
+
+class GameArchive:
+    """An append-only archive of finished games.
+
+    Games are buffered and written in batches on a worker thread, either as
+    NDJSON with every game its own gzip member or as PGN. Files are named
+    after the day they were started on and rolled over once they exceed
+    `max_size` bytes. The file and offset of every game are kept in an
+    SQLite index for `ArchiveReader`.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        format: str = "ndjson",
+        max_size: int = 64 * 1024 * 1024,
+        prefix: str = "games",
+    ):
+        if format not in FORMATS:
+            raise ValueError(
+                f"Unknown archive format {format!r}, expected one of {FORMATS}"
+            )
+        self.directory = directory
+        self.format = format
+        self.max_size = max_size
+        self.prefix = prefix
+        self.written = 0
+        self._pending: "list[dict]" = []
+        self._path: Optional[str] = None
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="archive")
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def add(self, record: dict):
+        self._pending.append(record)
+
+    def _file(self) -> str:
+        day = datetime.now(timezone.utc).strftime("%Y%m%d")
+        extension = "ndjson.gz" if self.format == "ndjson" else "pgn"
+        if (
+            self._path is not None
+            and os.path.basename(self._path).startswith(f"{self.prefix}-{day}-")
+            and os.path.getsize(self._path) < self.max_size
+        ):
+            return self._path
+        part = 0
+        while True:
+            path = os.path.join(
+                self.directory, f"{self.prefix}-{day}-{part:03d}.{extension}"
+            )
+            if not os.path.exists(path) or os.path.getsize(path) < self.max_size:
+                self._path = path
+                return path
+            part += 1
+
+    def _encode(self, record: dict) -> bytes:
+        if self.format == "pgn":
+            return to_pgn(record).encode()
+        line = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+        return gzip.compress(line, mtime=0)
+
+    def _write(self, records: "list[dict]"):
+        if self._db is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._db = open_index(self.directory)
+        path = self._file()
+        chunks = [self._encode(record) for record in records]
+        with open(path, "ab") as f:
+            offset = f.tell()
+            f.write(b"".join(chunks))
+        rows = []
+        name = os.path.basename(path)
+        for record, chunk in zip(records, chunks):
+            rows.append(
+                (
+                    record["id"],
+                    name,
+                    offset,
+                    len(chunk),
+                    record["finished"],
+                    record["status"],
+                    record["winner"],
+                    len(record["moves"]),
+                )
+            )
+            offset += len(chunk)
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    async def flush(self):
+        if not self._pending:
+            return
+        records = self._pending
+        self._pending = []
+        await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._write, records
+        )
+        self.written += len(records)
+
+    async def close(self):
+        await self.flush()
+        if self._db is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._db.close
+            )
+        self._executor.shutdown(wait=False)
+
+
+def open_index(directory: str) -> sqlite3.Connection:
+    db = sqlite3.connect(
+        os.path.join(directory, "index.sqlite"), check_same_thread=False, timeout=30
+    )
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS games (id TEXT PRIMARY KEY, file TEXT, "
+        "offset INTEGER, length INTEGER, finished REAL, status TEXT, winner TEXT, "
+        "plies INTEGER)"
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS games_finished ON games (finished)")
+    return db
+
+
+class ArchiveReader:
+    """Reads games from a `GameArchive` directory one at a time.
+
+    NDJSON games are returned as dicts and PGN games as `chess.pgn.Game`.
+    Single games and filtered selections are read through the index;
+    iterating over the reader scans the files in order.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._db = open_index(directory)
+        self._files: "dict[str, io.BufferedReader]" = {}
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+    def _read(self, name: str, offset: int, length: int) -> Union[dict, chess.pgn.Game]:
+        f = self._files.get(name)
+        if f is None:
+            f = self._files[name] = open(os.path.join(self.directory, name), "rb")
+        f.seek(offset)
+        data = f.read(length)
+        if name.endswith(".pgn"):
+            return chess.pgn.read_game(io.StringIO(data.decode()))
+        return decode_json(gzip.decompress(data))[0]
+
+    def get(self, game_id: str) -> Optional[Union[dict, chess.pgn.Game]]:
+        row = self._db.execute(
+            "SELECT file, offset, length FROM games WHERE id = ?", (game_id,)
+        ).fetchone()
+        return self._read(*row) if row is not None else None
+
+    def select(
+        self,
+        *,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        status: Optional[str] = None,
+        winner: Optional[str] = None,
+    ) -> Iterator[Union[dict, chess.pgn.Game]]:
+        """Yields the games matching all the given filters, in the order they finished."""
+        conditions, params = [], []
+        for column, op, value in (
+            ("finished", ">=", since),
+            ("finished", "<", until),
+            ("status", "=", status),
+            ("winner", "=", winner),
+        ):
+            if value is not None:
+                conditions.append(f"{column} {op} ?")
+                params.append(value)
+        query = "SELECT file, offset, length FROM games"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        for row in self._db.execute(query + " ORDER BY finished", params):
+            yield self._read(*row)
+
+    def __iter__(self) -> Iterator[Union[dict, chess.pgn.Game]]:
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".ndjson.gz"):
+                with gzip.open(path, "rb") as f:
+                    try:
+                        for line in f:
+                            yield decode_json(line)[0]
+                    except EOFError:
+                        # A batch cut short by a crash
+                        continue
+            elif name.endswith(".pgn"):
+                with open(path) as f:
+                    while True:
+                        game = chess.pgn.read_game(f)
+                        if game is None:
+                            break
+                        yield game
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+        self._db.close()
+
+
+def game_record(
+    handler: "GameStreamHandler", status: str, winner: Optional[str]
+) -> dict:
+    """Collects what the archive keeps of a game played by `handler`."""
+    game = handler.game
+    return {
+        "id": game.id,
+        "variant": game.variant.value if game.variant is not None else None,
+        "color": game.color.value,
+        "opponent": game.to_json().get("opponent", {}).get("username"),
+        "started": handler.started_at,
+        "finished": time.time(),
+        "status": status,
+        "winner": winner,
+        "moves": [move.uci() for move in handler.board.move_stack],
+        "clocks": handler.clocks,
+        "search": handler.search_stats,
+    }
@@ -0,0 +1,27 @@
+import random
+from typing import Optional
+
+
+class Backoff:
+    """Jittered exponential backoff between reconnection attempts.
+
+    Delays are drawn uniformly up to an exponentially growing ceiling, and a
+    server-requested delay such as Retry-After is always honoured.
+    """
+
+    def __init__(self, base: float = 1, cap: float = 60, factor: float = 2):
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+        self.attempts = 0
+
+    def next_delay(self, retry_after: Optional[float] = None) -> float:
+        ceiling = min(self.cap, self.base * self.factor**self.attempts)
+        self.attempts += 1
+        delay = random.uniform(self.base / 2, max(self.base / 2, ceiling))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def reset(self):
+        self.attempts = 0
@@ -0,0 +1,268 @@
+"""Benchmarks the bot against a local mock of Lichess.
+
+Live mode plays `--games` games through `APIStreamHandler` and
+`GameStreamHandler` against `mockserver.MockLichess` and a stub or real UCI
+engine. Replay mode feeds recorded NDJSON game streams through the event
+parsing and board synchronisation path without any network or engine.
+
+    python benchmark.py --games 20 --concurrency 4
+    python benchmark.py --synthesize games.ndjson --games 100
+    python benchmark.py --replay games.ndjson --chunk-size 64
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+
+def percentiles(values: "list[float]") -> str:
+    if not values:
+        return "n=0"
+    values = sorted(values)
+
+    def at(q: float) -> float:
+        return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+    return (
+        f"n={len(values)} p50={at(0.5):.3f}ms p90={at(0.9):.3f}ms "
+        f"p99={at(0.99):.3f}ms max={values[-1] * 1000:.3f}ms"
+    )
+
+
+async def run_live(args: argparse.Namespace):
+    from mockserver import MockLichess
+
+    mock = MockLichess(
+        games=args.games,
+        concurrency=args.concurrency,
+        max_plies=args.max_plies,
+        clock=args.clock,
+        increment=args.increment,
+        opponent_delay=args.delay,
+        chunk_size=args.chunk_size,
+        drop_rate=args.drop_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        bots=args.outbound,
+        seed=args.seed,
+    )
+    url = await mock.start()
+
+    # The app reads its configuration when it is imported and set up
+    os.environ["TOKEN"] = os.getenv("TOKEN", "benchmark")
+    os.environ["LICHESS_URL"] = url
+    os.environ.setdefault("ENGINE_PATH", args.engine)
+    os.environ.setdefault("ENGINE_POOL_SIZE", str(args.concurrency))
+    os.environ.setdefault("MAX_GAMES", str(args.concurrency))
+    os.environ.setdefault("EVAL_CACHE_SIZE", "0")
+    os.environ.setdefault("HTTP_RATE", "1000")
+    os.environ.setdefault("HTTP_BURST", "1000")
+    if args.adaptive:
+        os.environ.setdefault("ADAPTIVE_SEARCH", "true")
+    if args.outbound:
+        os.environ.setdefault("MATCHMAKING", "true")
+        os.environ.setdefault("MATCHMAKING_INTERVAL", "0.5")
+        os.environ.setdefault("MATCHMAKING_CLOCKS", "1+0,2+1,3+0,5+3,10+0")
+        os.environ.setdefault("MATCHMAKING_COOLDOWN", "1")
+        os.environ.setdefault("MATCHMAKING_REMATCH_COOLDOWN", "0")
+    from app import APIStreamHandler, App
+    from supervisor import SupervisorApp
+
+    app = SupervisorApp(args.workers) if args.workers > 0 else App()
+    if args.quiet:
+        app.log.setLevel(logging.WARNING)
+    await app.setup()
+    app.scheduler.start()
+
+    if args.memory:
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    listener = asyncio.create_task(APIStreamHandler(app).listen())
+    startup = asyncio.create_task(app.start())
+    try:
+        await asyncio.wait_for(mock.done.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        print(f"Timed out after {args.timeout}s", file=sys.stderr)
+    elapsed = time.perf_counter() - started
+    if args.memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    listener.cancel()
+    startup.cancel()
+    await asyncio.gather(listener, startup, return_exceptions=True)
+    await app.close()
+    await mock.close()
+
+    plies = sum(game.board.ply() for game in mock.games.values())
+    print(
+        f"Games: {len(mock.games)} played, {mock.declined} declined in {elapsed:.2f}s"
+    )
+    print(
+        f"Events: {mock.events_sent} ({mock.events_sent / elapsed:.0f}/s), "
+        f"plies: {plies} ({plies / elapsed:.0f}/s)"
+    )
+    print(f"Move latency: {percentiles(mock.latencies)}")
+    print(f"Faults: {mock.drops} dropped streams, {mock.rate_limited} rate limits")
+    if args.outbound:
+        print(
+            f"Matchmaking: {mock.challenges_sent} challenges sent, "
+            f"{mock.challenges_declined} declined"
+        )
+    if mock.resigned or mock.draws_offered:
+        print(f"Adjudicated: {mock.resigned} resigned, {mock.draws_offered} drawn")
+    if args.memory:
+        print(
+            f"Memory: {(peak - baseline) / 1024:.0f} KiB peak, "
+            f"{(peak - baseline) / 1024 / max(1, args.concurrency):.0f} KiB per game"
+        )
+    print(f"Stages: {app.metrics.summary()}")
+
+
+class ChunkedStream:
+    """Serves a byte string in fixed-size chunks like `aiohttp.StreamReader.iter_any`."""
+
+    def __init__(self, data: bytes, chunk_size: int, delay: float = 0):
+        self.data = data
+        self.chunk_size = chunk_size or len(data)
+        self.delay = delay
+
+    async def iter_any(self):
+        for i in range(0, len(self.data), self.chunk_size):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield self.data[i : i + self.chunk_size]
+
+
+def split_games(path: str) -> "list[bytes]":
+    """Splits a recording into one stream per game, each starting at a gameFull event."""
+    games: "list[bytearray]" = []
+    with open(path, "rb") as f:
+        for line in f:
+            if b'"gameFull"' in line or not games:
+                games.append(bytearray())
+            games[-1] += line
+    return [bytes(game) for game in games]
+
+
+async def replay_game(
+    data: bytes, args: argparse.Namespace, latencies: "list[float]"
+) -> int:
+    from boardsync import BoardSynchronizer
+    from datamodels import APIEvent, GameStateEvent
+    from utils import iter_ndjson
+
+    sync = BoardSynchronizer()
+    events = 0
+    stream = ChunkedStream(data, args.chunk_size, args.delay)
+    started = time.perf_counter()
+    async for raw in iter_ndjson(stream):
+        event = APIEvent.from_json(raw)
+        if isinstance(event, GameStateEvent):
+            sync.sync(event.moves)
+        events += 1
+        now = time.perf_counter()
+        latencies.append(now - started)
+        started = now
+    return events
+
+
+async def run_replay(args: argparse.Namespace):
+    games = split_games(args.replay)
+    latencies: "list[float]" = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def worker(data: bytes) -> int:
+        async with semaphore:
+            return await replay_game(data, args, latencies)
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        counts = await asyncio.gather(*[worker(game) for game in games])
+    elapsed = time.perf_counter() - started
+    events = sum(counts) * args.repeat
+    print(f"Replayed {len(games)} game(s) x{args.repeat} in {elapsed:.2f}s")
+    print(f"Events: {events} ({events / elapsed:.0f}/s)")
+    print(f"Per event: {percentiles(latencies)}")
+
+
+def synthesize(args: argparse.Namespace):
+    from mockserver import game_stream_events, synthetic_game
+
+    rng = random.Random(args.seed)
+    with open(args.synthesize, "w") as f:
+        for i in range(args.games):
+            moves = synthetic_game(rng, args.max_plies)
+            for event in game_stream_events(
+                f"s{i:07d}", moves, args.clock, args.increment
+            ):
+                f.write(json.dumps(event) + "\n")
+    print(f"Wrote {args.games} game(s) to {args.synthesize}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--replay", metavar="FILE", help="replay a recording offline")
+    mode.add_argument(
+        "--synthesize", metavar="FILE", help="write a synthetic recording"
+    )
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-plies", type=int, default=80)
+    parser.add_argument("--clock", type=int, default=60, help="seconds")
+    parser.add_argument("--increment", type=int, default=0, help="seconds")
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=0,
+        help="seconds before each opponent move, or between replayed chunks",
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=0, help="split stream writes into chunks"
+    )
+    parser.add_argument("--drop-rate", type=float, default=0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="replay passes")
+    parser.add_argument(
+        "--outbound",
+        type=int,
+        default=0,
+        metavar="BOTS",
+        help="challenge this many mock bots instead of answering challenges",
+    )
+    parser.add_argument(
+        "--engine",
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "stubengine.py"
+        ),
+        help="UCI engine, used unless ENGINE_PATH is set",
+    )
+    parser.add_argument(
+        "--adaptive", action="store_true", help="search with ADAPTIVE_SEARCH"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=0, help="play the games on worker processes"
+    )
+    parser.add_argument("--memory", action="store_true", help="trace memory usage")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quiet", action="store_true", help="hide info logs")
+    args = parser.parse_args()
+
+    if args.synthesize:
+        synthesize(args)
+    elif args.replay:
+        asyncio.run(run_replay(args))
+    else:
+        asyncio.run(run_live(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import chess
+
+
+class BoardSynchronizer:
+    """Keeps a local board in step with the server's moves string.
+
+    Only the suffix of the moves string that has not been applied yet is
+    parsed. The board is replayed from scratch only when the server's moves
+    diverge from what was applied locally.
+    """
+
+    board: chess.Board
+    applied: int
+    incremental: int
+    unchanged: int
+    replays: int
+
+    def __init__(self):
+        self.board = chess.Board()
+        self.applied = 0
+        self.incremental = 0
+        self.unchanged = 0
+        self.replays = 0
+        self._moves = ""
+
+    @property
+    def pending(self) -> int:
+        """Number of local moves the server has not confirmed yet."""
+        return len(self.board.move_stack) - self.applied
+
+    def sync(self, moves: str) -> int:
+        """Applies new server moves to the board and returns how many were new."""
+        moves = moves.strip()
+        if moves == self._moves:
+            self.unchanged += 1
+            return 0
+        if not moves.startswith(self._moves) or (
+            self._moves and moves[len(self._moves)] != " "
+        ):
+            return self.replay(moves)
+
+        new = moves[len(self._moves) :].split()
+        for uci in new:
+            move = chess.Move.from_uci(uci)
+            if self.pending > 0:
+                if self.board.move_stack[self.applied] != move:
+                    return self.replay(moves)
+            elif not self.board.is_legal(move):
+                return self.replay(moves)
+            else:
+                self.board.push(move)
+            self.applied += 1
+
+        self._moves = moves
+        self.incremental += 1
+        return len(new)
+
+    def replay(self, moves: str) -> int:
+        """Rebuilds the board from the full moves string."""
+        moves = moves.strip()
+        previous = self.applied
+        self.board.reset()
+        self.applied = 0
+        self._moves = ""
+        for uci in moves.split():
+            self.board.push_uci(uci)
+            self.applied += 1
+        self._moves = moves
+        self.replays += 1
+        return max(0, self.applied - previous)
+
+    def stats(self) -> "dict[str, int]":
+        return {
+            "incremental": self.incremental,
+            "unchanged": self.unchanged,
+            "replays": self.replays,
+        }
@@ -0,0 +1,38 @@
+from typing import Optional
+
+import chess
+import chess.polyglot
+
+
+class OpeningBook:
+    """A Polyglot opening book.
+
+    The book file is memory mapped, so a probe is a binary search over the
+    Zobrist keys of the file and does not read it from disk up front.
+    """
+
+    SELECTIONS = ("weighted", "best")
+
+    def __init__(self, path: str, *, max_depth: int = 20, selection: str = "weighted"):
+        if selection not in self.SELECTIONS:
+            raise ValueError(
+                f"Unknown book selection {selection!r}, expected one of {self.SELECTIONS}"
+            )
+        self.path = path
+        self.max_depth = max_depth
+        self.selection = selection
+        self.reader = chess.polyglot.open_reader(path)
+
+    def probe(self, board: chess.Board) -> Optional[chess.Move]:
+        """Returns a book move for the position, or None if it is out of book."""
+        if board.ply() >= self.max_depth:
+            return None
+        try:
+            if self.selection == "best":
+                return self.reader.find(board).move
+            return self.reader.weighted_choice(board).move
+        except IndexError:
+            return None
+
+    def close(self):
+        self.reader.close()
@@ -1,5 +1,12 @@
+import atexit
+import json
 import logging
+import os
+import queue
+import time
 from enum import Enum
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
 
 
 class Color(Enum):
@@ -26,15 +33,90 @@ COLORS = {
     "DEBUG": Color.WHITE,
 }
 
+# Fields passed with `extra` that the JSON output includes
+FIELDS = ("game", "event")
+
 
 class Logger(logging.Logger):
+    """The bot's logger, which never blocks the event loop on output.
+
+    Records are put on a queue as they are and formatted and written by a
+    background thread, so messages are only formatted when they are
+    written. The level is read from `LOG_LEVEL` and the output format from
+    `LOG_FORMAT`, which is either `color` or `json` for JSON lines. Repeated
+    warnings are rate limited.
+    """
+
     def __init__(self):
-        super().__init__("BOT", logging.DEBUG)
-        self.setLevel(logging.DEBUG)
+        super().__init__("BOT", os.getenv("LOG_LEVEL", "DEBUG").upper())
+        if os.getenv("LOG_FORMAT", "color").lower() == "json":
+            formatter = JSONFormatter()
+        else:
+            formatter = Formatter()
         handler = logging.StreamHandler()
-        formatter = Formatter()
         handler.setFormatter(formatter)
-        self.addHandler(handler)
+
+        records = queue.SimpleQueue()
+        self.addHandler(LazyQueueHandler(records))
+        self.addFilter(RateLimitFilter())
+        self._listener: Optional[QueueListener] = QueueListener(records, handler)
+        self._listener.start()
+        atexit.register(self.close)
+
+    def close(self):
+        """Writes out the queued records and stops the background thread."""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+
+class LazyQueueHandler(QueueHandler):
+    """Queues records without formatting them on the calling thread.
+
+    Only tracebacks are rendered up front, as the frames they refer to may
+    be gone by the time the record is written.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through `burst` warnings with the same message template every `interval` seconds.
+
+    The first warning let through after others were dropped reports how
+    many were.
+    """
+
+    MAX_TEMPLATES = 1000
+
+    def __init__(self, interval: float = 10, burst: int = 5):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self._windows: "dict[object, list]" = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.WARNING:
+            return True
+        now = time.monotonic()
+        window = self._windows.get(record.msg)
+        if window is None or now - window[0] >= self.interval:
+            if window is None and len(self._windows) >= self.MAX_TEMPLATES:
+                self._windows.clear()
+            suppressed = window[2] if window is not None else 0
+            self._windows[record.msg] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
 
 
 class Formatter(logging.Formatter):
@@ -44,4 +126,28 @@ class Formatter(logging.Formatter):
     def format(self, record: logging.LogRecord):
         color = COLORS[record.levelname]
         record.levelname = Color.colorize(record.levelname, color)
-        return super().format(record)
+        message = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            message += f" ({suppressed} similar messages suppressed)"
+        return message
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord):
+        data = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            data["suppressed"] = suppressed
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, default=str)
@@ -1,139 +1,200 @@
+from typing import Optional
+
 from enums import *
 
+# Plain dict lookups are several times faster than calling the enum classes
+COLORS = {color.value: color for color in Color}
+VARIANTS = {variant.value: variant for variant in Variant}
+STATUSES = {status.value: status for status in GameStatus}
+DECLINE_REASONS = {reason.value: reason for reason in DeclineReason}
+
 
 class APIEvent:
-    def __init__(self, _type: str):
-        self.type = EventType(_type)
+    __slots__ = ()
+    type: EventType
 
     @classmethod
-    def from_json(cls, data: dict):
-        try:
-            event_type = EventType(data["type"])
-        except ValueError:
-            return None
-
-        if event_type == EventType.GAME_START:
-            return GameStartEvent(data)
-
-        elif event_type == EventType.GAME_FINISH:
-            return GameFinishEvent(data)
-
-        elif event_type == EventType.CHALLENGE:
-            return ChallengeEvent(data)
-
-        elif event_type == EventType.GAME_STATE:
-            return GameStateEvent(data)
-
-        elif event_type == EventType.GAME_FULL:
-            return GameStateEvent(data["state"])
-
-        else:
+    def from_json(cls, data: dict) -> Optional["APIEvent"]:
+        factory = EVENTS.get(data.get("type"))
+        if factory is None:
             return None
+        return factory(data)
 
 
 class APIGameEvent(APIEvent):
+    __slots__ = ("game",)
+
     def __init__(self, data: dict):
-        super().__init__(data["type"])
         self.game = Game.from_json(data["game"])
 
 
 class GameStartEvent(APIGameEvent):
-    def __init__(self, data: dict):
-        super().__init__(data)
+    __slots__ = ()
+    type = EventType.GAME_START
 
 
 class GameFinishEvent(APIGameEvent):
-    def __init__(self, data: dict):
-        super().__init__(data)
+    __slots__ = ()
+    type = EventType.GAME_FINISH
 
 
 class APIChallengeEvent(APIEvent):
+    __slots__ = ("challenge",)
+
     def __init__(self, data: dict):
-        super().__init__(data["type"])
         self.challenge = Challenge.from_json(data["challenge"])
 
 
 class ChallengeEvent(APIChallengeEvent):
-    def __init__(self, data: dict):
-        super().__init__(data)
+    __slots__ = ()
+    type = EventType.CHALLENGE
 
 
 class ChallengeCanceledEvent(APIChallengeEvent):
-    def __init__(self, data: dict):
-        super().__init__(data)
+    __slots__ = ()
+    type = EventType.CHALLENGE_CANCELED
 
 
 class ChallengeDeclinedEvent(APIChallengeEvent):
-    def __init__(self, data: dict):
-        super().__init__(data)
+    __slots__ = ()
+    type = EventType.CHALLENGE_DECLINED
 
 
 class GameStateEvent(APIEvent):
+    __slots__ = (
+        "moves",
+        "wtime",
+        "btime",
+        "winc",
+        "binc",
+        "status",
+        "winner",
+        "wdraw",
+        "bdraw",
+    )
+    type = EventType.GAME_STATE
     moves: str
     wtime: int
     btime: int
     winc: int
     binc: int
     status: GameStatus
+    winner: Optional[str]
+    wdraw: bool
+    bdraw: bool
 
     def __init__(self, data: dict):
-        super().__init__(data["type"])
         self.moves = data["moves"]
         self.wtime = data["wtime"]
         self.btime = data["btime"]
         self.winc = data["winc"]
         self.binc = data["binc"]
-        self.status = GameStatus(data["status"])
+        self.status = STATUSES[data["status"]]
+        self.winner = data.get("winner")
+        self.wdraw = data.get("wdraw", False)
+        self.bdraw = data.get("bdraw", False)
+
+
+class GameFullEvent(GameStateEvent):
+    """The full state of a game, sent first whenever its stream is connected."""
+
+    __slots__ = ()
+    type = EventType.GAME_FULL
+
+    def __init__(self, data: dict):
+        super().__init__(data["state"])
+
+
+EVENTS = {
+    EventType.GAME_START.value: GameStartEvent,
+    EventType.GAME_FINISH.value: GameFinishEvent,
+    EventType.CHALLENGE.value: ChallengeEvent,
+    EventType.CHALLENGE_CANCELED.value: ChallengeCanceledEvent,
+    EventType.CHALLENGE_DECLINED.value: ChallengeDeclinedEvent,
+    EventType.GAME_STATE.value: GameStateEvent,
+    EventType.GAME_FULL.value: GameFullEvent,
+}
 
 
 class DataModel:
-    pass
+    __slots__ = ()
 
 
 class Game(DataModel):
+    """A game from a gameStart or gameFinish event.
+
+    Only the fields the bot reads on every event are parsed up front, the
+    others are read from the JSON when they are accessed.
+    """
+
+    __slots__ = ("id", "color", "variant", "_json")
     id: str
     color: Color
-    fen: str
-    has_moved: bool
-    is_my_turn: bool
-    last_move: bool
-    variant: Variant
+    variant: Optional[Variant]
 
     @classmethod
-    def from_json(cls, json):
+    def from_json(cls, json: dict):
         obj = cls.__new__(cls)
         obj.id = json["gameId"]
-        obj.color = Color(json["color"])
-        obj.fen = json["fen"]
-        obj.has_moved = json["hasMoved"]
-        obj.is_my_turn = json["isMyTurn"]
-        obj.last_move = json["lastMove"]
-        obj.variant = Variant(json["variant"]["key"])
+        obj.color = COLORS[json["color"]]
+        obj.variant = VARIANTS.get(json["variant"]["key"])
+        obj._json = json
 
         return obj
 
+    @property
+    def fen(self) -> str:
+        return self._json["fen"]
+
+    @property
+    def has_moved(self) -> bool:
+        return self._json["hasMoved"]
+
+    @property
+    def is_my_turn(self) -> bool:
+        return self._json["isMyTurn"]
+
+    @property
+    def last_move(self) -> str:
+        return self._json["lastMove"]
+
+    @property
+    def speed(self) -> Optional[str]:
+        return self._json.get("speed")
+
+    def to_json(self) -> dict:
+        return self._json
+
 
 class Challenge(DataModel):
+    __slots__ = ("id", "variant", "time_control", "challenger", "decline_reason")
     id: str
-    variant: Variant
-    time_control: "TimeControl"
+    variant: Optional[Variant]
+    time_control: Optional["TimeControl"]
+    challenger: Optional[str]
+    decline_reason: Optional[DeclineReason]
 
     @classmethod
     def from_json(cls, json: dict):
         obj = cls.__new__(cls)
         obj.id = json["id"]
-        obj.variant = Variant(json["variant"]["key"])
-        try:
+        obj.variant = VARIANTS.get(json["variant"]["key"])
+        challenger = json.get("challenger")
+        obj.challenger = challenger["id"] if challenger else None
+        obj.decline_reason = DECLINE_REASONS.get(json.get("declineReasonKey"))
+        time_control = json.get("timeControl")
+        if time_control is not None and "limit" in time_control:
             obj.time_control = TimeControl(
-                json["timeControl"]["limit"], json["timeControl"]["increment"]
+                time_control["limit"], time_control["increment"]
             )
-        except:
+        else:
             obj.time_control = None
 
         return obj
 
 
 class TimeControl:
+    __slots__ = ("limit", "increment")
     limit: int
     increment: int
 
@@ -143,6 +204,7 @@ class TimeControl:
 
 
 class BotUser(DataModel):
+    __slots__ = ("id", "username")
     id: str
     username: str
 
@@ -0,0 +1,320 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+import chess
+import chess.engine
+
+from colorlogs import Logger
+from profiles import DEFAULT_PROFILE, OPTIONS, EngineProfile
+
+
+class EngineSlot:
+    index: int
+    protocol: Optional[chess.engine.UciProtocol]
+    transport: Optional[asyncio.SubprocessTransport]
+    owner: Optional[str]
+    preempt: Optional[Callable[[], None]]
+    restarts: int
+    profile: EngineProfile
+
+    def __init__(self, index: int):
+        self.index = index
+        self.protocol = None
+        self.transport = None
+        self.owner = None
+        self.preempt = None
+        self.restarts = 0
+        self.profile = DEFAULT_PROFILE
+
+    @property
+    def busy(self) -> bool:
+        return self.owner is not None
+
+    @property
+    def alive(self) -> bool:
+        return self.protocol is not None and not self.protocol.returncode.done()
+
+
+class EnginePool:
+    """A fixed-size pool of UCI engine processes.
+
+    Games lease an engine for every search. A game is given back the engine it
+    used last whenever that engine is free, so its hash table stays warm.
+    When all engines are busy the game waits in a FIFO queue, and engines
+    held for background work such as pondering are preempted for it.
+
+    Games can ask for an engine profile, which is applied when the engine
+    is leased. Only the options that differ from the ones the engine has are
+    sent, and engines already on the profile are preferred, so switching is
+    rare and cheap.
+
+    The engines are started at once. Every engine answers `isready` after
+    its options are set and optionally runs a `warmup` second search, so the
+    first game does not pay for loading the engine. Leases wait until all
+    engines have started.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        log: Logger,
+        *,
+        size: int = 1,
+        threads: int = 0,
+        hash_size: int = 0,
+        profiles: "Optional[dict[str, EngineProfile]]" = None,
+        warmup: float = 0,
+        health_timeout: float = 5,
+    ):
+        self.path = path
+        self.log = log
+        self.size = max(1, size)
+        self.threads = threads
+        self.hash_size = hash_size
+        self.profiles = profiles or {}
+        self.reconfigurations = 0
+        self.warmup = warmup
+        self.health_timeout = health_timeout
+        self.ready = asyncio.Event()
+        # Seconds the slowest engine spent in every startup phase
+        self.startup: "dict[str, float]" = {}
+        self.slots = [EngineSlot(i) for i in range(self.size)]
+        self._affinity: "dict[str, int]" = {}
+        self._waiters: "list[tuple[str, asyncio.Future]]" = []
+
+    @property
+    def options(self) -> "dict[str, int]":
+        """UCI options of a single engine, the configured totals split across the pool."""
+        options = {}
+        if self.threads > 0:
+            options["Threads"] = max(1, self.threads // self.size)
+        if self.hash_size > 0:
+            options["Hash"] = max(1, self.hash_size // self.size)
+        return options
+
+    def profile(self, speed: Optional[str]) -> EngineProfile:
+        """The profile of the games of a speed."""
+        return self.profiles.get(speed, DEFAULT_PROFILE)
+
+    @property
+    def idle(self) -> int:
+        return sum(not slot.busy for slot in self.slots)
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def start(self):
+        await asyncio.gather(*[self._start(slot) for slot in self.slots])
+        self.ready.set()
+        self.log.info(
+            "Started %s engine(s) with options %s", self.size, self.options or "{}"
+        )
+        for profile in self.profiles.values():
+            self.log.info("Engine profile %s", profile)
+
+    async def close(self):
+        for slot in self.slots:
+            await self._kill(slot)
+        for _, waiter in self._waiters:
+            waiter.cancel()
+        self._waiters.clear()
+
+    async def _start(self, slot: EngineSlot):
+        timings = {}
+        await self._spawn(slot, timings)
+        if self.warmup > 0:
+            started = time.perf_counter()
+            await slot.protocol.play(
+                chess.Board(), chess.engine.Limit(time=self.warmup)
+            )
+            timings["warmup"] = time.perf_counter() - started
+        for phase, seconds in timings.items():
+            self.startup[phase] = max(self.startup.get(phase, 0.0), seconds)
+
+    async def _spawn(
+        self, slot: EngineSlot, timings: "Optional[dict[str, float]]" = None
+    ):
+        started = time.perf_counter()
+        slot.transport, slot.protocol = await chess.engine.popen_uci(self.path)
+        spawned = time.perf_counter()
+        options = {
+            name: value
+            for name, value in self.options.items()
+            if name in slot.protocol.options
+        }
+        if options:
+            await slot.protocol.configure(options)
+        await slot.protocol.ping()
+        slot.profile = DEFAULT_PROFILE
+        if timings is not None:
+            timings["spawn"] = spawned - started
+            timings["isready"] = time.perf_counter() - spawned
+
+    async def _apply(self, slot: EngineSlot, profile: EngineProfile):
+        if slot.profile is profile:
+            return
+        options = {}
+        for name in OPTIONS.values():
+            option = slot.protocol.options.get(name)
+            if option is None:
+                continue
+            # Options the profile leaves alone go back to the pool's or the engine's
+            options[name] = profile.options.get(
+                name, self.options.get(name, option.default)
+            )
+        # Unchanged options are not sent to the engine
+        await slot.protocol.configure(options)
+        slot.profile = profile
+        self.reconfigurations += 1
+
+    async def _kill(self, slot: EngineSlot):
+        if slot.protocol is None:
+            return
+        try:
+            await asyncio.wait_for(slot.protocol.quit(), self.health_timeout)
+        except (asyncio.TimeoutError, chess.engine.EngineError):
+            pass
+        finally:
+            if slot.transport is not None:
+                slot.transport.close()
+            slot.protocol = None
+            slot.transport = None
+
+    async def _restart(self, slot: EngineSlot):
+        self.log.warning("Restarting engine #%s", slot.index)
+        slot.restarts += 1
+        await self._kill(slot)
+        await self._spawn(slot)
+
+    def _pick(
+        self, game_id: str, profile: EngineProfile = DEFAULT_PROFILE
+    ) -> Optional[EngineSlot]:
+        preferred = self._affinity.get(game_id)
+        if preferred is not None and not self.slots[preferred].busy:
+            return self.slots[preferred]
+        free = [slot for slot in self.slots if not slot.busy]
+        if not free:
+            return None
+        # Prefer engines that no other game is attached to, then ones on the profile
+        attached = set(self._affinity.values())
+        return min(
+            free,
+            key=lambda slot: (slot.index in attached, slot.profile is not profile),
+        )
+
+    async def acquire(
+        self, game_id: str, profile: EngineProfile = DEFAULT_PROFILE
+    ) -> EngineSlot:
+        if not self.ready.is_set():
+            await self.ready.wait()
+        slot = self._pick(game_id, profile) if not self._waiters else None
+        if slot is None:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append((game_id, waiter))
+            self._preempt()
+            try:
+                slot = await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self.release(waiter.result())
+                elif (game_id, waiter) in self._waiters:
+                    self._waiters.remove((game_id, waiter))
+                raise
+
+        slot.owner = game_id
+        self._affinity[game_id] = slot.index
+        try:
+            if not slot.alive:
+                await self._restart(slot)
+            await self._apply(slot, profile)
+        except BaseException:
+            self.release(slot)
+            raise
+        return slot
+
+    def try_acquire(
+        self, game_id: str, profile: EngineProfile = DEFAULT_PROFILE
+    ) -> Optional[EngineSlot]:
+        """Leases a live engine only if one is free and no game is waiting.
+
+        The profile is not applied, see `configure`.
+        """
+        if self._waiters or not self.ready.is_set():
+            return None
+        slot = self._pick(game_id, profile)
+        if slot is None or not slot.alive:
+            return None
+        slot.owner = game_id
+        self._affinity[game_id] = slot.index
+        return slot
+
+    async def configure(self, slot: EngineSlot, profile: EngineProfile):
+        """Applies a profile to a leased engine."""
+        await self._apply(slot, profile)
+
+    def release(self, slot: EngineSlot):
+        slot.owner = None
+        slot.preempt = None
+        self._hand_over(slot)
+
+    def _preempt(self):
+        for slot in self.slots:
+            if slot.preempt is not None:
+                preempt = slot.preempt
+                slot.preempt = None
+                preempt()
+                return
+
+    def _hand_over(self, slot: EngineSlot):
+        # Skip games canceled while waiting whose tasks have not run yet
+        self._waiters = [entry for entry in self._waiters if not entry[1].done()]
+        if not self._waiters:
+            return
+        # A waiting game that used this engine last goes first
+        for i, (game_id, _) in enumerate(self._waiters):
+            if self._affinity.get(game_id) == slot.index:
+                break
+        else:
+            i = 0
+        game_id, waiter = self._waiters.pop(i)
+        slot.owner = game_id
+        waiter.set_result(slot)
+
+    def forget(self, game_id: str):
+        """Drops the engine affinity of a finished game."""
+        self._affinity.pop(game_id, None)
+
+    @asynccontextmanager
+    async def lease(self, game_id: str, profile: EngineProfile = DEFAULT_PROFILE):
+        slot = await self.acquire(game_id, profile)
+        try:
+            yield slot.protocol
+        except chess.engine.EngineTerminatedError:
+            self.log.warning("Engine #%s terminated during a search", slot.index)
+            raise
+        finally:
+            self.release(slot)
+
+    async def health_check(self):
+        if not self.ready.is_set():
+            return
+        for slot in self.slots:
+            if slot.busy:
+                continue
+            slot.owner = "<health-check>"
+            try:
+                if slot.alive:
+                    await asyncio.wait_for(slot.protocol.ping(), self.health_timeout)
+                else:
+                    await self._restart(slot)
+            except (asyncio.TimeoutError, chess.engine.EngineError):
+                self.log.warning("Engine #%s failed a health check", slot.index)
+                try:
+                    await self._restart(slot)
+                except Exception as e:
+                    self.log.error("Failed to restart engine #%s: %s", slot.index, e)
+            finally:
+                self.release(slot)
@@ -6,15 +6,24 @@ class EventType(Enum):
     GAME_START = "gameStart"
     GAME_FINISH = "gameFinish"
     CHALLENGE = "challenge"
-    CHALLENGE_CANCELED = "challengeCanceled"  # not handled
-    CHALLENGE_DECLINED = "challengeDeclined"  # not handled
+    CHALLENGE_CANCELED = "challengeCanceled"
+    CHALLENGE_DECLINED = "challengeDeclined"
 
-    GAME_FULL = "gameFull"  # handle redirected
+    GAME_FULL = "gameFull"
     GAME_STATE = "gameState"
 
 
 class Variant(Enum):
     STANDARD = "standard"
+    CHESS960 = "chess960"
+    CRAZYHOUSE = "crazyhouse"
+    ANTICHESS = "antichess"
+    ATOMIC = "atomic"
+    HORDE = "horde"
+    KING_OF_THE_HILL = "kingOfTheHill"
+    RACING_KINGS = "racingKings"
+    THREE_CHECK = "threeCheck"
+    FROM_POSITION = "fromPosition"
 
 
 class Color(Enum):
@@ -36,3 +45,38 @@ class GameStatus(Enum):
     NO_START = "noStart"
     UNKNOWN_FINISH = "unknownFinish"
     VARIANT_END = "variantEnd"
+
+
+class DeclineReason(Enum):
+    GENERIC = "generic"
+    LATER = "later"
+    TOO_FAST = "tooFast"
+    TOO_SLOW = "tooSlow"
+    TIME_CONTROL = "timeControl"
+    RATED = "rated"
+    CASUAL = "casual"
+    STANDARD = "standard"
+    VARIANT = "variant"
+    NO_BOT = "noBot"
+    ONLY_BOT = "onlyBot"
+
+
+class AdmissionDecision(Enum):
+    ACCEPT = "accept"
+    QUEUE = "queue"
+    DECLINE = "decline"
+
+
+class Adjudication(Enum):
+    RESIGN = "resign"
+    OFFER_DRAW = "offer_draw"
+    ACCEPT_DRAW = "accept_draw"
+    DECLINE_DRAW = "decline_draw"
+
+
+class RequestPriority(Enum):
+    MOVE = 0
+    GAME_STREAM = 1
+    STREAM = 2
+    CHALLENGE = 3
+    HOUSEKEEPING = 4
@@ -1,8 +1,20 @@
+from typing import Optional
+
+
 class ConnectionFailure(Exception):
-    def __init__(self, resp_code: int, msg: str):
+    status: int
+    retry_after: Optional[float]
+
+    def __init__(self, resp_code: int, msg: str, retry_after: Optional[float] = None):
         super().__init__(
             f"Connection failed | Response code: {resp_code} | Error message: {msg}"
         )
+        self.status = resp_code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status == 429 or self.status >= 500
 
 
 class JSONDecodeFailure(Exception):
@@ -0,0 +1,194 @@
+import asyncio
+import math
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import chess
+import chess.engine
+import chess.polyglot
+
+
+class CachedEval:
+    move: chess.Move
+    depth: int
+    score: Optional[chess.engine.Score]
+    pv: "list[chess.Move]"
+
+    def __init__(
+        self,
+        move: chess.Move,
+        depth: int,
+        score: Optional[chess.engine.Score],
+        pv: "list[chess.Move]",
+    ):
+        self.move = move
+        self.depth = depth
+        self.score = score
+        self.pv = pv
+
+    @property
+    def ponder(self) -> Optional[chess.Move]:
+        return self.pv[1] if len(self.pv) > 1 else None
+
+    def row(self, key: int) -> tuple:
+        cp = mate = None
+        if self.score is not None:
+            if self.score.is_mate():
+                mate = self.score.mate()
+            else:
+                cp = self.score.score()
+        # SQLite integers are signed
+        if key >= 1 << 63:
+            key -= 1 << 64
+        return (key, self.depth, cp, mate, " ".join(move.uci() for move in self.pv))
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "tuple[int, CachedEval]":
+        key, depth, cp, mate, pv = row
+        if mate is not None:
+            score = chess.engine.Mate(mate)
+        elif cp is not None:
+            score = chess.engine.Cp(cp)
+        else:
+            score = None
+        moves = [chess.Move.from_uci(uci) for uci in pv.split()]
+        return key % (1 << 64), cls(moves[0], depth, score, moves)
+
+
+class EvalCache:
+    """Engine results shared by all games, keyed by the Zobrist hash of the position.
+
+    When full, the shallowest of the least recently used entries is evicted.
+    With a path, entries are loaded from and written behind to an SQLite
+    database on a worker thread.
+    """
+
+    EVICTION_WINDOW = 8
+    DEPTH_PER_DOUBLING = 1.0
+
+    def __init__(self, size: int = 100000, path: Optional[str] = None):
+        self.size = size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, CachedEval]" = OrderedDict()
+        self._dirty: "dict[int, CachedEval]" = {}
+        self._depth_offset: Optional[float] = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="evalcache")
+        self._db: Optional[sqlite3.Connection] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, board: chess.Board) -> Optional[CachedEval]:
+        key = chess.polyglot.zobrist_hash(board)
+        entry = self._entries.get(key)
+        if entry is None or not board.is_legal(entry.move):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(
+        self, board: chess.Board, result: chess.engine.PlayResult, seconds: float = 0
+    ):
+        """Stores a search result; `seconds` is its length if the engine did not report it."""
+        info = result.info
+        if result.move is None or "depth" not in info:
+            return
+        pv = info.get("pv") or [result.move]
+        if pv[0] != result.move:
+            pv = [result.move]
+        score = info["score"].relative if "score" in info else None
+        key = chess.polyglot.zobrist_hash(board)
+        previous = self._entries.get(key)
+        if previous is not None and previous.depth > info["depth"]:
+            self._entries.move_to_end(key)
+            return
+        entry = CachedEval(result.move, info["depth"], score, pv)
+        self._store(key, entry)
+        if self.path is not None:
+            self._dirty[key] = entry
+        seconds = info.get("time", seconds)
+        if seconds > 0:
+            self._observe(seconds, info["depth"])
+
+    def _store(self, key: int, entry: CachedEval):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.size:
+            window = []
+            for candidate in self._entries:
+                window.append(candidate)
+                if len(window) == self.EVICTION_WINDOW:
+                    break
+            del self._entries[min(window, key=lambda k: self._entries[k].depth)]
+
+    def _observe(self, seconds: float, depth: int):
+        offset = depth - self.DEPTH_PER_DOUBLING * math.log2(seconds)
+        if self._depth_offset is None:
+            self._depth_offset = offset
+        else:
+            self._depth_offset += 0.1 * (offset - self._depth_offset)
+
+    def expected_depth(self, seconds: float) -> Optional[float]:
+        """Estimates the depth a search of the given length reaches, from recent searches."""
+        if self._depth_offset is None or seconds <= 0:
+            return None
+        return self._depth_offset + self.DEPTH_PER_DOUBLING * math.log2(seconds)
+
+    def lookup(self, board: chess.Board, seconds: float) -> Optional[CachedEval]:
+        """Returns a cached result at least as deep as a search of `seconds` would be."""
+        expected = self.expected_depth(seconds)
+        if expected is None or board.is_repetition(2):
+            return None
+        entry = self.get(board)
+        if entry is None or entry.depth < expected:
+            return None
+        return entry
+
+    def _open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS evals "
+            "(key INTEGER PRIMARY KEY, depth INTEGER, cp INTEGER, mate INTEGER, pv TEXT)"
+        )
+        rows = self._db.execute(
+            "SELECT key, depth, cp, mate, pv FROM evals ORDER BY depth DESC LIMIT ?",
+            (self.size,),
+        ).fetchall()
+        return [CachedEval.from_row(row) for row in rows]
+
+    def _write(self, rows: "list[tuple]"):
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO evals VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    async def load(self):
+        if self.path is None:
+            return
+        loop = asyncio.get_running_loop()
+        entries = await loop.run_in_executor(self._executor, self._open)
+        for key, entry in reversed(entries):
+            self._entries[key] = entry
+
+    async def flush(self):
+        if self._db is None or not self._dirty:
+            return
+        rows = [entry.row(key) for key, entry in self._dirty.items()]
+        self._dirty.clear()
+        await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._write, rows
+        )
+
+    async def close(self):
+        await self.flush()
+        if self._db is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._db.close
+            )
+        self._executor.shutdown(wait=False)
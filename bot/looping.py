@@ -1,9 +1,24 @@
 import asyncio
-from datetime import datetime, timedelta
-from typing import Coroutine
+import heapq
+import itertools
+import time
+from datetime import timedelta
+from typing import Coroutine, Optional
+
+from colorlogs import Logger
 
 
 class Loop:
+    """A coroutine function run periodically by a `Scheduler`.
+
+    Runs are due on a fixed grid of the monotonic clock, so a late run does
+    not shift the following ones. When a run takes longer than the interval,
+    the `skip` policy drops the runs it overlapped and `catch_up` runs them
+    back to back.
+    """
+
+    POLICIES = ("skip", "catch_up")
+
     def __init__(
         self,
         func: Coroutine,
@@ -11,17 +26,105 @@ class Loop:
         seconds: int = 0,
         minutes: int = 0,
         hours: int = 0,
-        sleep_interval: int = 3
+        overrun: str = "skip",
     ):
+        if overrun not in self.POLICIES:
+            raise ValueError(
+                f"Unknown overrun policy {overrun!r}, expected one of {self.POLICIES}"
+            )
         self.func = func
-        self._next_run = datetime.now()
-        self._td_kwargs = {"hours": hours, "minutes": minutes, "seconds": seconds}
-        self.sleep_interval = sleep_interval
+        self.interval = timedelta(
+            hours=hours, minutes=minutes, seconds=seconds
+        ).total_seconds()
+        if self.interval <= 0:
+            raise ValueError("Loop interval must be positive")
+        self.overrun = overrun
+        self.next_run: Optional[float] = None
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+
+    def schedule_next(self, now: float):
+        self.next_run += self.interval
+        if self.overrun == "skip" and self.next_run < now:
+            missed = int((now - self.next_run) // self.interval) + 1
+            self.skipped += missed
+            self.next_run += missed * self.interval
+
+
+class Scheduler:
+    """Runs loops from a single heap of deadlines.
+
+    The scheduler sleeps until the earliest deadline and never wakes up
+    otherwise. Every run is its own task, so a slow or failing loop neither
+    delays nor stops the others.
+    """
 
-    async def start(self, *args):
+    def __init__(self, log: Logger):
+        self.log = log
+        self.loops: "list[Loop]" = []
+        self._heap: "list[tuple[float, int, Loop]]" = []
+        self._counter = itertools.count()
+        self._changed: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: "set[asyncio.Task]" = set()
+
+    def add(self, loop: Loop):
+        self.loops.append(loop)
+        if self._task is not None:
+            self._push(loop, time.monotonic())
+
+    def _push(self, loop: Loop, now: float):
+        if loop.next_run is None:
+            loop.next_run = now
+        heapq.heappush(self._heap, (loop.next_run, next(self._counter), loop))
+        if self._changed is not None:
+            self._changed.set()
+
+    def start(self):
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        now = time.monotonic()
+        for loop in self.loops:
+            self._push(loop, now)
+
+    async def stop(self):
+        tasks = [self._task, *self._running] if self._task is not None else []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
         while True:
-            if datetime.now() > self._next_run:
-                self._next_run += timedelta(**self._td_kwargs)
-                await self.func(*args)
+            self._changed.clear()
+            if not self._heap:
+                await self._changed.wait()
+                continue
+
+            deadline = self._heap[0][0]
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, loop = heapq.heappop(self._heap)
+            task = asyncio.create_task(self._call(loop))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _call(self, loop: Loop):
+        try:
+            await loop.func()
+        except Exception as e:
+            loop.failures += 1
+            self.log.exception("Loop %s failed: %s", loop.func.__qualname__, e)
+        finally:
+            loop.runs += 1
 
-            await asyncio.sleep(self.sleep_interval)
+        now = time.monotonic()
+        loop.schedule_next(now)
+        self._push(loop, now)
@@ -1,29 +1,19 @@
-from random import choice
+import os
 
 from app import APIStreamHandler, App
-from datamodels import BotUser
-from utils import decode_json
-
-app = App()
-
-
-@app.main
-async def main():
-    stream_handler = APIStreamHandler(app)
-    await stream_handler.begin_listening()
-
-
-# @app.loop(minutes=10)
-# async def challenge_sender():
-#     r = await app.session.get('/api/account/playing')
-#     now_playing = await r.json()
-#     if len(now_playing["nowPlaying"]) > 0:
-#         return
-
-#     r = await app.session.get("/api/bot/online")
-#     users = [BotUser.from_json(d) for d in decode_json(await r.content.read())]
-#     user = choice(users)
-#     await app.challenges.send_challenge(user)
-
-
-app.run()
+from supervisor import SupervisorApp
+
+# Worker processes are spawned and import this module as `__mp_main__`, so
+# the app is only built when it is run
+if __name__ == "__main__":
+    if int(os.getenv("WORKERS", "0")) > 0:
+        app = SupervisorApp(int(os.getenv("WORKERS")))
+    else:
+        app = App()
+
+    @app.main
+    async def main():
+        stream_handler = APIStreamHandler(app)
+        await stream_handler.begin_listening()
+
+    app.run()
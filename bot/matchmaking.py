@@ -0,0 +1,284 @@
+import random
+import time
+from typing import Optional
+
+from admission import AdmissionController
+from colorlogs import Logger
+from datamodels import BotUser, Challenge, Game
+from enums import DeclineReason, RequestPriority
+from ratelimit import RequestScheduler
+from utils import iter_ndjson
+
+# Clocks as (limit, increment) in seconds
+CLOCKS = (
+    (120, 0),
+    (300, 0),
+    (300, 3),
+    (600, 0),
+    (600, 5),
+    (900, 0),
+    (900, 5),
+    (1800, 0),
+    (1800, 10),
+)
+
+
+def parse_clocks(spec: str) -> "list[tuple[int, int]]":
+    """Parses clocks written like on Lichess, e.g. `3+2,10+0` for minutes and increment."""
+    clocks = []
+    for clock in spec.split(","):
+        minutes, increment = clock.strip().split("+")
+        clocks.append((int(float(minutes) * 60), int(increment)))
+    return clocks
+
+
+class BotDirectory:
+    """The bots online, fetched from `/api/bot/online` at most every `ttl` seconds.
+
+    The list is parsed line by line as it is streamed, and the last list
+    fetched is kept when a refresh fails.
+    """
+
+    def __init__(
+        self, http: RequestScheduler, log: Logger, *, ttl: float = 600, limit: int = 200
+    ):
+        self.http = http
+        self.log = log
+        self.ttl = ttl
+        self.limit = limit
+        self.fetched_at: Optional[float] = None
+        self._bots: "list[BotUser]" = []
+
+    async def bots(self) -> "list[BotUser]":
+        if self.fetched_at is None or time.monotonic() - self.fetched_at >= self.ttl:
+            await self.refresh()
+        return self._bots
+
+    async def refresh(self):
+        r = await self.http.get(
+            "/api/bot/online",
+            RequestPriority.HOUSEKEEPING,
+            params={"nb": self.limit},
+            stream=True,
+        )
+        try:
+            if r.status != 200:
+                self.log.warning(
+                    "Failed to fetch the online bots. Error code: %s", r.status
+                )
+                return
+            self._bots = [
+                BotUser.from_json(data) async for data in iter_ndjson(r.content)
+            ]
+            self.fetched_at = time.monotonic()
+            self.log.debug("Fetched %s online bots", len(self._bots))
+        finally:
+            r.release()
+
+
+class OpponentStats:
+    sent: int
+    accepted: int
+    declined: int
+    streak: int
+    cooldown_until: float
+    min_duration: float
+    max_duration: float
+    rejected: "set[tuple[int, int]]"
+
+    def __init__(self):
+        self.sent = 0
+        self.accepted = 0
+        self.declined = 0
+        self.streak = 0
+        self.cooldown_until = 0.0
+        self.min_duration = 0.0
+        self.max_duration = float("inf")
+        self.rejected = set()
+
+    @property
+    def accept_rate(self) -> float:
+        """The share of challenges accepted, starting from an even chance."""
+        return (self.accepted + 1) / (self.sent + 2)
+
+    def allows(self, clock: "tuple[int, int]") -> bool:
+        duration = AdmissionController.clock_duration(*clock)
+        return (
+            clock not in self.rejected
+            and self.min_duration <= duration <= self.max_duration
+        )
+
+
+class Matchmaker:
+    """Challenges online bots while there is engine capacity left.
+
+    Every run sends challenges, up to `max_outgoing` unanswered ones at a
+    time, with clocks whose load still fits the admission controller, so
+    the capacity is charged as soon as a challenge is sent. Opponents are
+    picked at random weighted by how often they accepted our challenges.
+    A decline puts the opponent on a cooldown that doubles with every
+    decline in a row, and decline reasons about the clock narrow down the
+    clocks offered to it. Challenges left unanswered for `timeout` seconds
+    are canceled.
+    """
+
+    def __init__(
+        self,
+        challenges: "ChallengesHandler",
+        admission: AdmissionController,
+        directory: BotDirectory,
+        log: Logger,
+        *,
+        clocks: "list[tuple[int, int]]" = CLOCKS,
+        max_outgoing: int = 2,
+        timeout: float = 60,
+        cooldown: float = 300,
+        max_cooldown: float = 86400,
+        rematch_cooldown: float = 1800,
+    ):
+        self.challenges = challenges
+        self.admission = admission
+        self.directory = directory
+        self.log = log
+        self.clocks = list(clocks)
+        self.max_outgoing = max_outgoing
+        self.timeout = timeout
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.rematch_cooldown = rematch_cooldown
+        self.user_id: Optional[str] = None
+        self.opponents: "dict[str, OpponentStats]" = {}
+        # Unanswered challenges by ID, with the opponent, clock and time sent
+        self.outgoing: "dict[str, tuple[str, tuple[int, int], float]]" = {}
+        self.sent = 0
+        self.accepted = 0
+        self.declined = 0
+
+    def stats(self, user_id: str) -> OpponentStats:
+        stats = self.opponents.get(user_id)
+        if stats is None:
+            stats = self.opponents[user_id] = OpponentStats()
+        return stats
+
+    def owns(self, challenge: Challenge) -> bool:
+        """Whether the challenge is one we sent."""
+        return challenge.id in self.outgoing or (
+            self.user_id is not None and challenge.challenger == self.user_id
+        )
+
+    def _fitting_clocks(self) -> "list[tuple[int, int]]":
+        clocks = []
+        for clock in self.clocks:
+            duration = AdmissionController.clock_duration(*clock)
+            if self.admission.min_duration and duration < self.admission.min_duration:
+                continue
+            if self.admission.max_duration and duration > self.admission.max_duration:
+                continue
+            if self.admission.fits_load(self.admission.clock_load(*clock)):
+                clocks.append(clock)
+        return clocks
+
+    async def run(self):
+        if not self.admission.ready:
+            return
+        if self.user_id is None:
+            self.user_id = await self.challenges.account_id()
+            if self.user_id is None:
+                return
+        await self._expire()
+        # Challengers waiting in the admission queue go first
+        while len(self.outgoing) < self.max_outgoing and not self.admission.queue:
+            clocks = self._fitting_clocks()
+            if not clocks:
+                return
+            if not await self._challenge(clocks):
+                return
+
+    async def _challenge(self, clocks: "list[tuple[int, int]]") -> bool:
+        now = time.monotonic()
+        targets = {user_id for user_id, _, _ in self.outgoing.values()}
+        candidates = []
+        for bot in await self.directory.bots():
+            if bot.id == self.user_id or bot.id in targets:
+                continue
+            stats = self.stats(bot.id)
+            if stats.cooldown_until > now:
+                continue
+            allowed = [clock for clock in clocks if stats.allows(clock)]
+            if allowed:
+                candidates.append((bot, stats, allowed))
+        if not candidates:
+            self.log.debug("No bot to challenge")
+            return False
+
+        bot, stats, allowed = random.choices(
+            candidates, [stats.accept_rate for _, stats, _ in candidates]
+        )[0]
+        clock = random.choice(allowed)
+        stats.sent += 1
+        self.sent += 1
+        challenge_id = await self.challenges.send_challenge(bot, clock)
+        if challenge_id is None:
+            self._declined(bot.id)
+            return False
+        self.outgoing[challenge_id] = (bot.id, clock, now)
+        self.admission.reserve(
+            challenge_id, self.admission.clock_load(*clock), self.timeout
+        )
+        return True
+
+    async def _expire(self):
+        deadline = time.monotonic() - self.timeout
+        for challenge_id, (user_id, _, sent_at) in list(self.outgoing.items()):
+            if sent_at < deadline:
+                self.log.info("Canceling unanswered challenge %s", challenge_id)
+                del self.outgoing[challenge_id]
+                self.admission.release(challenge_id)
+                self._declined(user_id)
+                await self.challenges.cancel_challenge(challenge_id)
+
+    def _declined(self, user_id: str, reason: Optional[DeclineReason] = None):
+        stats = self.stats(user_id)
+        stats.declined += 1
+        self.declined += 1
+        # A bot that is busy now may well accept later
+        if reason != DeclineReason.LATER:
+            stats.streak += 1
+        cooldown = min(self.max_cooldown, self.cooldown * 2 ** max(0, stats.streak - 1))
+        stats.cooldown_until = time.monotonic() + cooldown
+
+    def on_declined(self, challenge: Challenge):
+        """Records the decline or cancellation of a challenge we sent."""
+        outgoing = self.outgoing.pop(challenge.id, None)
+        if outgoing is None:
+            return
+        user_id, clock, _ = outgoing
+        self.admission.release(challenge.id)
+        reason = challenge.decline_reason
+        self.log.info(
+            "Challenge %s to %s was declined: %s",
+            challenge.id,
+            user_id,
+            reason.value if reason is not None else "no reason",
+        )
+        self._declined(user_id, reason)
+        stats = self.stats(user_id)
+        duration = AdmissionController.clock_duration(*clock)
+        if reason == DeclineReason.TOO_FAST:
+            stats.min_duration = max(stats.min_duration, duration + 1)
+        elif reason == DeclineReason.TOO_SLOW:
+            stats.max_duration = min(stats.max_duration, duration - 1)
+        elif reason == DeclineReason.TIME_CONTROL:
+            stats.rejected.add(clock)
+
+    def on_game_start(self, game: Game):
+        """Records the acceptance of a challenge we sent."""
+        outgoing = self.outgoing.pop(game.id, None)
+        if outgoing is None:
+            return
+        user_id, _, _ = outgoing
+        stats = self.stats(user_id)
+        stats.accepted += 1
+        stats.streak = 0
+        stats.cooldown_until = time.monotonic() + self.rematch_cooldown
+        self.accepted += 1
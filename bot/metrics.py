@@ -0,0 +1,192 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import web
+
+from colorlogs import Logger
+
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class Histogram:
+    """A fixed-bucket latency histogram in seconds."""
+
+    def __init__(self, buckets: "tuple[float, ...]" = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile as the upper bound of the bucket it falls in."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """Latency histograms of the move pipeline stages and gauges of the app state.
+
+    Stages are observed with `span` or `observe` and exposed in the Prometheus
+    text format by `serve`, along with any routes added with `route`.
+    """
+
+    PREFIX = "hermes"
+
+    def __init__(self):
+        self.histograms: "dict[str, Histogram]" = {}
+        self.gauges: "dict[str, tuple[str, str, Callable[[], float]]]" = {}
+        self.routes: "list[tuple[str, Callable]]" = []
+        self._runner: Optional[web.AppRunner] = None
+
+    def observe(self, stage: str, seconds: float):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+    @contextmanager
+    def span(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def gauge(self, name: str, description: str, func: Callable[[], float]):
+        self.gauges[name] = ("gauge", description, func)
+
+    def counter(self, name: str, description: str, func: Callable[[], float]):
+        self.gauges[name] = ("counter", description, func)
+
+    def route(self, path: str, handler: Callable):
+        """Serves a GET handler next to the metrics. Must be called before `serve`."""
+        self.routes.append((path, handler))
+
+    def summary(self) -> str:
+        return ", ".join(
+            f"{stage} n={h.count} p50={h.quantile(0.5) * 1000:.1f}ms "
+            f"p99={h.quantile(0.99) * 1000:.1f}ms max={h.max * 1000:.1f}ms"
+            for stage, h in sorted(self.histograms.items())
+            if h.count > 0
+        )
+
+    def render(self) -> str:
+        name = f"{self.PREFIX}_stage_seconds"
+        lines = [
+            f"# HELP {name} Latency of the move pipeline stages.",
+            f"# TYPE {name} histogram",
+        ]
+        for stage, h in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(h.buckets, h.counts):
+                cumulative += count
+                lines.append(
+                    f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}'
+                )
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {h.sum}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {h.count}')
+
+        for gauge, (kind, description, func) in sorted(self.gauges.items()):
+            gauge = f"{self.PREFIX}_{gauge}"
+            lines.append(f"# HELP {gauge} {description}")
+            lines.append(f"# TYPE {gauge} {kind}")
+            lines.append(f"{gauge} {func()}")
+        return "\n".join(lines) + "\n"
+
+    async def _handle(self, _: web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type="text/plain")
+
+    async def serve(self, host: str, port: int):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        for path, handler in self.routes:
+            app.router.add_get(path, handler)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class StartupTimer:
+    """Times the phases of the startup, which run concurrently.
+
+    Every phase is logged with its start and end relative to the creation of
+    the timer and observed as a `startup_<phase>` stage. Once all `phases`
+    are done the total is logged.
+    """
+
+    def __init__(self, log: Logger, metrics: Metrics, phases: "tuple[str, ...]"):
+        self.log = log
+        self.metrics = metrics
+        self.phases = phases
+        self.started = time.perf_counter()
+        self.timings: "dict[str, tuple[float, float]]" = {}
+
+    @property
+    def finished(self) -> bool:
+        return all(phase in self.timings for phase in self.phases)
+
+    async def run(self, phase: str, coro: Awaitable):
+        started = time.perf_counter() - self.started
+        result = await coro
+        self.done(phase, started)
+        return result
+
+    def done(self, phase: str, started: float = 0.0, detail: str = ""):
+        """Records the end of a phase that began `started` seconds after startup."""
+        if phase in self.timings:
+            return
+        ended = time.perf_counter() - self.started
+        self.timings[phase] = (started, ended)
+        self.metrics.observe(f"startup_{phase}", ended - started)
+        self.log.info(
+            "Startup: %s took %.3fs (%.3fs to %.3fs)%s",
+            phase,
+            ended - started,
+            started,
+            ended,
+            f", {detail}" if detail else "",
+        )
+        if self.finished:
+            self.log.info(
+                "Started up in %.3fs",
+                max(end for _, end in self.timings.values()),
+            )
@@ -0,0 +1,444 @@
+"""A local mock of the Lichess bot API for benchmarks and fault injection."""
+
+import asyncio
+import json
+import random
+import time
+from typing import Optional
+
+import chess
+from aiohttp import web
+
+from profiles import speed
+
+
+def synthetic_game(rng: random.Random, max_plies: int) -> "list[str]":
+    """Plays random legal moves and returns them as UCI strings."""
+    board = chess.Board()
+    while board.ply() < max_plies and not board.is_game_over():
+        board.push(rng.choice(list(board.legal_moves)))
+    return [move.uci() for move in board.move_stack]
+
+
+def game_stream_events(
+    game_id: str, moves: "list[str]", clock: int, increment: int
+) -> "list[dict]":
+    """The gameFull and gameState events of a game stream that plays `moves`."""
+
+    def state(ply: int, status: str = "started") -> dict:
+        return {
+            "type": "gameState",
+            "moves": " ".join(moves[:ply]),
+            "wtime": clock * 1000,
+            "btime": clock * 1000,
+            "winc": increment * 1000,
+            "binc": increment * 1000,
+            "status": status,
+        }
+
+    events = [
+        {
+            "type": "gameFull",
+            "id": game_id,
+            "variant": {"key": "standard"},
+            "state": state(0),
+        }
+    ]
+    events.extend(state(ply) for ply in range(1, len(moves) + 1))
+    events.append(state(len(moves), "draw"))
+    return events
+
+
+class MockGame:
+    def __init__(self, game_id: str, color: chess.Color, clock: int, increment: int):
+        self.id = game_id
+        self.color = color
+        self.board = chess.Board()
+        self.clocks = {chess.WHITE: clock * 1000, chess.BLACK: clock * 1000}
+        self.increment = increment * 1000
+        self.speed = speed(clock, increment)
+        self.status = "started"
+        self.winner: Optional[str] = None
+        self.queue: "Optional[asyncio.Queue[Optional[dict]]]" = None
+        self.turn_started = 0.0
+        self.finished = asyncio.Event()
+
+    def state(self) -> dict:
+        return {
+            "type": "gameState",
+            "moves": " ".join(move.uci() for move in self.board.move_stack),
+            "wtime": int(self.clocks[chess.WHITE]),
+            "btime": int(self.clocks[chess.BLACK]),
+            "winc": self.increment,
+            "binc": self.increment,
+            "status": self.status,
+            **({"winner": self.winner} if self.winner else {}),
+        }
+
+    def full(self) -> dict:
+        return {
+            "type": "gameFull",
+            "id": self.id,
+            "variant": {"key": "standard"},
+            "state": self.state(),
+        }
+
+    def game_json(self) -> dict:
+        return {
+            "gameId": self.id,
+            "color": "white" if self.color == chess.WHITE else "black",
+            "fen": self.board.fen(),
+            "hasMoved": False,
+            "isMyTurn": self.color == chess.WHITE,
+            "lastMove": "",
+            "variant": {"key": "standard"},
+            "speed": self.speed,
+        }
+
+
+class MockLichess:
+    """Serves the event stream, game streams and move and challenge endpoints.
+
+    Every game is offered to the bot as a challenge; at most `concurrency`
+    games run at once. With `bots`, the mock instead lists that many online
+    bots and answers the challenges the bot sends them, each bot accepting
+    at its own rate and declining clocks faster than it plays. The opponent answers with random legal moves after
+    `opponent_delay` seconds. Faults can be injected by splitting lines into
+    small chunks, dropping stream connections and answering with 429s.
+    """
+
+    def __init__(
+        self,
+        *,
+        games: int = 10,
+        concurrency: int = 4,
+        max_plies: int = 80,
+        clock: int = 60,
+        increment: int = 0,
+        opponent_delay: float = 0.0,
+        chunk_size: int = 0,
+        drop_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        bots: int = 0,
+        seed: int = 0,
+    ):
+        self.total = games
+        self.concurrency = concurrency
+        self.max_plies = max_plies
+        self.clock = clock
+        self.increment = increment
+        self.opponent_delay = opponent_delay
+        self.chunk_size = chunk_size
+        self.drop_rate = drop_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        # Username, accept rate and fastest clock accepted of every bot
+        self.bots = {
+            f"bot{i}": (
+                f"Bot{i}",
+                self.random.random(),
+                self.random.choice((0, 180, 600)),
+            )
+            for i in range(bots)
+        }
+
+        self.games: "dict[str, MockGame]" = {}
+        self.challenges: "list[str]" = []
+        self.latencies: "list[float]" = []
+        self.events_sent = 0
+        self.declined = 0
+        self.outgoing: "dict[str, tuple[str, int, int]]" = {}
+        self.challenges_sent = 0
+        self.challenges_declined = 0
+        self.resigned = 0
+        self.draws_offered = 0
+        self.drops = 0
+        self.rate_limited = 0
+        self.done = asyncio.Event()
+        self._created = 0
+        self._finished = 0
+        self._event_queue: "asyncio.Queue[Optional[dict]]" = asyncio.Queue()
+        self._closing = False
+        self._runner: Optional[web.AppRunner] = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/api/stream/event", self.event_stream)
+        app.router.add_get("/api/bot/game/stream/{id}", self.game_stream)
+        app.router.add_post("/api/bot/game/{id}/move/{move}", self.move)
+        app.router.add_post("/api/bot/game/{id}/resign", self.resign)
+        app.router.add_post("/api/bot/game/{id}/draw/{accept}", self.draw)
+        app.router.add_post("/api/challenge/{id}/accept", self.accept)
+        app.router.add_post("/api/challenge/{id}/decline", self.decline)
+        app.router.add_post("/api/challenge/{id}/cancel", self.cancel)
+        app.router.add_post("/api/challenge/{username}", self.challenge)
+        app.router.add_get("/api/account", self.account)
+        app.router.add_get("/api/bot/online", self.online)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        if not self.bots:
+            for _ in range(min(self.concurrency, self.total)):
+                self._challenge()
+        return f"http://{host}:{port}"
+
+    async def close(self):
+        self._closing = True
+        self._event_queue.put_nowait(None)
+        for game in self.games.values():
+            if game.queue is not None:
+                game.queue.put_nowait(None)
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def _challenge(self):
+        self._created += 1
+        challenge_id = f"g{self._created:07d}"
+        self.challenges.append(challenge_id)
+        self._event_queue.put_nowait(
+            {
+                "type": "challenge",
+                "challenge": {
+                    "id": challenge_id,
+                    "variant": {"key": "standard"},
+                    "timeControl": {
+                        "type": "clock",
+                        "limit": self.clock,
+                        "increment": self.increment,
+                    },
+                },
+            }
+        )
+
+    def _end_game(self, game: MockGame):
+        game.finished.set()
+        self._finished += 1
+        if self._created < self.total and not self.bots:
+            self._challenge()
+        if self._finished >= self.total:
+            self.done.set()
+
+    async def _write(self, response: web.StreamResponse, event: dict):
+        data = json.dumps(event).encode() + b"\n"
+        if self.chunk_size > 0:
+            for i in range(0, len(data), self.chunk_size):
+                await response.write(data[i : i + self.chunk_size])
+        else:
+            await response.write(data)
+        self.events_sent += 1
+
+    def _rate_limited(self) -> bool:
+        if self.random.random() < self.rate_limit_rate:
+            self.rate_limited += 1
+            return True
+        return False
+
+    async def event_stream(self, request: web.Request) -> web.StreamResponse:
+        if self._rate_limited():
+            return web.Response(status=429, text="Too many requests")
+        response = web.StreamResponse()
+        await response.prepare(request)
+        try:
+            while not self._closing:
+                try:
+                    event = await asyncio.wait_for(self._event_queue.get(), 5)
+                except asyncio.TimeoutError:
+                    await response.write(b"\n")
+                    continue
+                if event is None:
+                    break
+                await self._write(response, event)
+        except ConnectionResetError:
+            pass
+        return response
+
+    async def game_stream(self, request: web.Request) -> web.StreamResponse:
+        game = self.games.get(request.match_info["id"])
+        if game is None:
+            return web.Response(status=404, text="No such game")
+        if self._rate_limited():
+            return web.Response(status=429, text="Too many requests")
+
+        response = web.StreamResponse()
+        await response.prepare(request)
+        game.queue = asyncio.Queue()
+        game.turn_started = time.perf_counter()
+        try:
+            await self._write(response, game.full())
+            while game.status == "started":
+                event = await game.queue.get()
+                if event is None:
+                    break
+                await self._write(response, event)
+                if self.random.random() < self.drop_rate:
+                    # Leave half a line behind and drop the connection
+                    self.drops += 1
+                    await response.write(json.dumps(game.state()).encode()[:16])
+                    request.transport.close()
+                    break
+        except ConnectionResetError:
+            pass
+        return response
+
+    async def accept(self, request: web.Request) -> web.Response:
+        challenge_id = request.match_info["id"]
+        if challenge_id not in self.challenges:
+            return web.json_response({"error": "Not found"}, status=404)
+        self.challenges.remove(challenge_id)
+        self._start_game(challenge_id, self.clock, self.increment)
+        return web.json_response({"ok": True})
+
+    def _start_game(self, game_id: str, clock: int, increment: int):
+        color = chess.WHITE if len(self.games) % 2 == 0 else chess.BLACK
+        game = MockGame(game_id, color, clock, increment)
+        self.games[game_id] = game
+        self._event_queue.put_nowait({"type": "gameStart", "game": game.game_json()})
+        if color == chess.BLACK:
+            asyncio.create_task(self._opponent_move(game))
+
+    async def account(self, request: web.Request) -> web.Response:
+        return web.json_response({"id": "hermes", "username": "Hermes"})
+
+    async def online(self, request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for bot_id, (username, _, _) in list(self.bots.items())[
+            : int(request.query.get("nb", "50"))
+        ]:
+            await self._write(response, {"id": bot_id, "username": username})
+        return response
+
+    async def challenge(self, request: web.Request) -> web.Response:
+        bot_id = request.match_info["username"].lower()
+        if bot_id not in self.bots:
+            return web.json_response({"error": "No such bot"}, status=404)
+        data = await request.json()
+        clock = int(data["clock.limit"]), int(data["clock.increment"])
+        self.challenges_sent += 1
+        challenge_id = f"c{self.challenges_sent:07d}"
+        self.outgoing[challenge_id] = (bot_id, *clock)
+        self._event_queue.put_nowait(
+            {"type": "challenge", "challenge": self._challenge_json(challenge_id)}
+        )
+        asyncio.get_running_loop().call_later(
+            self.opponent_delay, self._answer, challenge_id
+        )
+        return web.json_response(self._challenge_json(challenge_id))
+
+    def _challenge_json(self, challenge_id: str) -> dict:
+        _, limit, increment = self.outgoing[challenge_id]
+        return {
+            "id": challenge_id,
+            "challenger": {"id": "hermes"},
+            "variant": {"key": "standard"},
+            "timeControl": {"type": "clock", "limit": limit, "increment": increment},
+        }
+
+    def _answer(self, challenge_id: str):
+        if challenge_id not in self.outgoing:
+            # Canceled
+            return
+        challenge = self._challenge_json(challenge_id)
+        bot_id, limit, increment = self.outgoing.pop(challenge_id)
+        _, accept_rate, fastest = self.bots[bot_id]
+        if limit + 40 * increment < fastest:
+            reason = "tooFast"
+        elif self._created >= self.total:
+            reason = "later"
+        elif self.random.random() >= accept_rate:
+            reason = "generic"
+        else:
+            self._created += 1
+            self._start_game(challenge_id, limit, increment)
+            return
+        self.challenges_declined += 1
+        challenge["declineReasonKey"] = reason
+        self._event_queue.put_nowait(
+            {"type": "challengeDeclined", "challenge": challenge}
+        )
+
+    async def cancel(self, request: web.Request) -> web.Response:
+        self.outgoing.pop(request.match_info["id"], None)
+        return web.json_response({"ok": True})
+
+    async def decline(self, request: web.Request) -> web.Response:
+        challenge_id = request.match_info["id"]
+        if challenge_id in self.challenges:
+            self.challenges.remove(challenge_id)
+            self.declined += 1
+            self._finished += 1
+            if self._created < self.total:
+                self._challenge()
+            if self._finished >= self.total:
+                self.done.set()
+        return web.json_response({"ok": True})
+
+    def _send(self, game: MockGame):
+        game.turn_started = time.perf_counter()
+        if game.queue is not None:
+            game.queue.put_nowait(game.state())
+
+    async def move(self, request: web.Request) -> web.Response:
+        game = self.games.get(request.match_info["id"])
+        if game is None or game.status != "started":
+            return web.json_response({"error": "Not your turn"}, status=400)
+        try:
+            move = chess.Move.from_uci(request.match_info["move"])
+        except ValueError:
+            move = None
+        if game.board.turn != game.color or move not in game.board.legal_moves:
+            return web.json_response({"error": "Illegal move"}, status=400)
+
+        elapsed = time.perf_counter() - game.turn_started
+        self.latencies.append(elapsed)
+        game.clocks[game.color] += game.increment - elapsed * 1000
+        game.board.push(move)
+        if request.query.get("offeringDraw") == "true":
+            # The opponent takes every draw offered
+            self.draws_offered += 1
+            game.status = "draw"
+            self._end_game(game)
+        elif not self._check_end(game):
+            asyncio.create_task(self._opponent_move(game))
+        self._send(game)
+        return web.json_response({"ok": True})
+
+    async def resign(self, request: web.Request) -> web.Response:
+        game = self.games.get(request.match_info["id"])
+        if game is None or game.status != "started":
+            return web.json_response({"error": "Game is over"}, status=400)
+        self.resigned += 1
+        game.status = "resign"
+        game.winner = "black" if game.color == chess.WHITE else "white"
+        self._end_game(game)
+        self._send(game)
+        return web.json_response({"ok": True})
+
+    async def draw(self, request: web.Request) -> web.Response:
+        # The opponent never offers a draw, so there is nothing to answer
+        return web.json_response({"error": "No draw offer"}, status=400)
+
+    async def _opponent_move(self, game: MockGame):
+        await asyncio.sleep(self.opponent_delay)
+        if game.status != "started":
+            return
+        game.board.push(self.random.choice(list(game.board.legal_moves)))
+        self._check_end(game)
+        self._send(game)
+
+    def _check_end(self, game: MockGame) -> bool:
+        if game.board.is_checkmate():
+            game.status = "mate"
+        elif game.board.is_game_over() or game.board.ply() >= self.max_plies:
+            game.status = "draw"
+        elif game.clocks[game.color] <= 0:
+            game.status = "outoftime"
+        else:
+            return False
+        self._end_game(game)
+        return True
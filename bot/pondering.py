@@ -0,0 +1,123 @@
+import asyncio
+import time
+from typing import Optional
+
+import chess
+import chess.engine
+
+from colorlogs import Logger
+from engines import EnginePool, EngineSlot
+from profiles import DEFAULT_PROFILE, EngineProfile
+
+
+class Ponderer:
+    """Searches the expected reply of the opponent while it is their turn.
+
+    The engine is held only while no other game needs it: a waiting game
+    preempts the search, which is then treated as a miss.
+    """
+
+    hits: int
+    misses: int
+
+    def __init__(
+        self,
+        pool: EnginePool,
+        game_id: str,
+        log: Logger,
+        profile: EngineProfile = DEFAULT_PROFILE,
+    ):
+        self.pool = pool
+        self.game_id = game_id
+        self.log = log
+        self.profile = profile
+        self.hits = 0
+        self.misses = 0
+        self._slot: Optional[EngineSlot] = None
+        self._analysis: Optional[chess.engine.AnalysisResult] = None
+        self._expected: Optional[chess.Move] = None
+        self._started = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self._analysis is not None
+
+    async def start(self, board: chess.Board, expected: Optional[chess.Move]):
+        """Starts pondering on `board` after the expected reply is played."""
+        if expected is None or self.active or not board.is_legal(expected):
+            return
+        slot = self.pool.try_acquire(self.game_id, self.profile)
+        if slot is None:
+            return
+
+        board = board.copy(stack=False)
+        board.push(expected)
+        try:
+            await self.pool.configure(slot, self.profile)
+            self._analysis = await slot.protocol.analysis(board, game=self.game_id)
+        except chess.engine.EngineError as e:
+            self.log.warning(
+                "Failed to start pondering in game %s: %s", self.game_id, e
+            )
+            self.pool.release(slot)
+            return
+
+        self._slot = slot
+        self._expected = expected
+        self._started = time.perf_counter()
+        slot.preempt = self.cancel
+        if self.pool.queued:
+            # A game started waiting while the search was being set up
+            self.cancel()
+
+    def cancel(self):
+        """Stops pondering and gives the engine back to the pool."""
+        if self._analysis is not None:
+            self._analysis.stop()
+            self._analysis = None
+        if self._slot is not None:
+            slot = self._slot
+            self._slot = None
+            self.pool.release(slot)
+
+    async def resolve(
+        self, board: chess.Board, min_time: float = 0
+    ) -> Optional[chess.engine.PlayResult]:
+        """Returns the pondered result if the opponent played the expected move.
+
+        On a ponderhit the search continues until it has run for at least
+        `min_time` seconds in total, and the result carries the info of the
+        search, such as its depth and score. On a miss the search is stopped and
+        None is returned.
+        """
+        if not self.active:
+            return None
+        if not board.move_stack or board.move_stack[-1] != self._expected:
+            self.misses += 1
+            self.cancel()
+            return None
+
+        analysis = self._analysis
+        remaining = min_time - (time.perf_counter() - self._started)
+        try:
+            if remaining > 0:
+                await asyncio.wait_for(asyncio.shield(analysis.wait()), remaining)
+        except asyncio.TimeoutError:
+            pass
+
+        if self._analysis is not analysis:
+            # Preempted by another game while finishing the search
+            self.misses += 1
+            return None
+        analysis.stop()
+        try:
+            best = await analysis.wait()
+        except chess.engine.EngineError:
+            best = None
+        self._analysis = None
+        self.cancel()
+        if best is None or best.move is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return chess.engine.PlayResult(best.move, best.ponder, dict(analysis.info))
@@ -0,0 +1,110 @@
+import json
+import os
+from typing import Optional
+
+import chess.engine
+
+# Upper bounds of the estimated game duration, in seconds, of the Lichess speeds
+SPEEDS = (
+    ("ultraBullet", 30),
+    ("bullet", 180),
+    ("blitz", 480),
+    ("rapid", 1500),
+    ("classical", None),
+)
+
+# Profile fields and the UCI options they set
+OPTIONS = {
+    "threads": "Threads",
+    "hash": "Hash",
+    "skill": "Skill Level",
+    "move_overhead": "Move Overhead",
+}
+
+
+def speed(limit: int, increment: int) -> str:
+    """The Lichess speed of a clock, from its limit and increment in seconds."""
+    duration = limit + 40 * increment
+    for name, bound in SPEEDS:
+        if bound is None or duration < bound:
+            return name
+
+
+class EngineProfile:
+    """Engine settings and search caps for the games of one speed.
+
+    Options left as None keep the value the engine pool is configured with.
+    """
+
+    name: str
+    threads: Optional[int]
+    hash: Optional[int]
+    skill: Optional[int]
+    move_overhead: Optional[int]
+    depth: Optional[int]
+    nodes: Optional[int]
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        threads: Optional[int] = None,
+        hash: Optional[int] = None,
+        skill: Optional[int] = None,
+        move_overhead: Optional[int] = None,
+        depth: Optional[int] = None,
+        nodes: Optional[int] = None,
+    ):
+        self.name = name
+        self.threads = threads
+        self.hash = hash
+        self.skill = skill
+        self.move_overhead = move_overhead
+        self.depth = depth
+        self.nodes = nodes
+
+    @property
+    def options(self) -> "dict[str, int]":
+        """The UCI options the profile sets."""
+        return {
+            option: getattr(self, field)
+            for field, option in OPTIONS.items()
+            if getattr(self, field) is not None
+        }
+
+    def limit(self, time: float) -> chess.engine.Limit:
+        return chess.engine.Limit(time=time, depth=self.depth, nodes=self.nodes)
+
+    def __str__(self):
+        caps = {"depth": self.depth, "nodes": self.nodes}
+        settings = {
+            **self.options,
+            **{name: value for name, value in caps.items() if value is not None},
+        }
+        return f"{self.name} {settings}"
+
+
+DEFAULT_PROFILE = EngineProfile("default")
+
+
+def load_profiles(spec: Optional[str]) -> "dict[str, EngineProfile]":
+    """Reads profiles keyed by speed from JSON, given inline or as the path to a file.
+
+    For example `{"bullet": {"threads": 1, "hash": 16, "depth": 14}}`.
+    """
+    if not spec:
+        return {}
+    if os.path.isfile(spec):
+        with open(spec) as f:
+            data = json.load(f)
+    else:
+        data = json.loads(spec)
+    known = {name for name, _ in SPEEDS} | {"correspondence"}
+    profiles = {}
+    for name, settings in data.items():
+        if name not in known:
+            raise ValueError(
+                f"Unknown speed {name!r} in the engine profiles, expected one of {sorted(known)}"
+            )
+        profiles[name] = EngineProfile(name, **settings)
+    return profiles
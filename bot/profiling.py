@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from colorlogs import Logger
+from metrics import Metrics
+
+
+class LoopMonitor:
+    """Measures how late the event loop runs its callbacks.
+
+    A heartbeat scheduled every `interval` seconds observes its own delay as
+    the `loop_lag` stage. A watchdog thread logs where the loop thread is
+    stuck once a heartbeat is `threshold` seconds overdue. With `debug`, the
+    loop runs in asyncio debug mode and callbacks that take longer than
+    `threshold` are counted and logged; debug mode slows the loop down, so
+    it is meant for tracking down a stall rather than for every day.
+    """
+
+    def __init__(
+        self,
+        log: Logger,
+        metrics: Metrics,
+        *,
+        interval: float = 0.05,
+        threshold: float = 0.1,
+        debug: bool = False,
+    ):
+        self.log = log
+        self.metrics = metrics
+        self.interval = interval
+        self.threshold = threshold
+        self.debug = debug
+        self.stalls = 0
+        self.slow_callbacks = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._expected = 0.0
+        self._beat = 0.0
+        self._thread_id: Optional[int] = None
+        self._stopped = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        if self.debug:
+            self._loop.set_debug(True)
+            self._loop.slow_callback_duration = self.threshold
+            logging.getLogger("asyncio").addFilter(self._on_asyncio_record)
+        self._beat = time.monotonic()
+        self._schedule(self._beat)
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self.debug:
+            logging.getLogger("asyncio").removeFilter(self._on_asyncio_record)
+
+    def _schedule(self, now: float):
+        self._expected = now + self.interval
+        self._handle = self._loop.call_later(self.interval, self._heartbeat)
+
+    def _heartbeat(self):
+        now = time.monotonic()
+        self.metrics.observe("loop_lag", max(0.0, now - self._expected))
+        self._beat = now
+        self._schedule(now)
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.threshold / 2):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.threshold or reported == beat:
+                continue
+            # Report every stall once, with the stack it was caught in
+            reported = beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            self.log.warning(
+                "The event loop has been blocked for %.3fs at:\n%s", blocked, stack
+            )
+
+    def _on_asyncio_record(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.msg, str) and record.msg.startswith("Executing"):
+            # "Executing <callback> took N seconds" from asyncio debug mode
+            self.slow_callbacks += 1
+            self.log.warning("Slow callback: %s", record.getMessage())
+            return False
+        return True
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads and writes them as collapsed stacks.
+
+    The output has a line of `frame;frame;frame count` per distinct stack,
+    as read by flamegraph.pl, speedscope and similar tools. Sampling runs
+    on its own thread, so the bot keeps playing while it is profiled.
+    """
+
+    def __init__(self, directory: str, log: Logger, *, interval: float = 0.005):
+        self.directory = directory
+        self.log = log
+        self.interval = interval
+        self.running = False
+
+    def _sample(self, seconds: float) -> "Counter[str]":
+        own = threading.get_ident()
+        stacks: "Counter[str]" = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(frames))] += 1
+            time.sleep(self.interval)
+        return stacks
+
+    def _write(self, profile: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"profile-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}.folded"
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write(profile)
+        return path
+
+    async def profile(self, seconds: float) -> Optional[str]:
+        """Profiles the process for `seconds` and returns the collapsed stacks.
+
+        Returns None if a profile is already being taken.
+        """
+        if self.running:
+            return None
+        self.running = True
+        self.log.info("Profiling for %ss", seconds)
+        loop = asyncio.get_running_loop()
+        try:
+            stacks = await loop.run_in_executor(None, self._sample, seconds)
+            profile = "".join(f"{stack} {count}\n" for stack, count in stacks.items())
+            path = await loop.run_in_executor(None, self._write, profile)
+        finally:
+            self.running = False
+        self.log.info("Wrote a profile of %s samples to %s", sum(stacks.values()), path)
+        return profile
@@ -0,0 +1,164 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Callable, Optional
+
+import aiohttp
+
+from enums import RequestPriority
+from metrics import Metrics
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def delay(self, reserve: float = 0) -> float:
+        """Seconds until a token can be taken while leaving `reserve` tokens behind."""
+        self._refill()
+        missing = 1 + reserve - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class RequestScheduler:
+    """Rate limits the requests of a session and orders them by priority.
+
+    All requests share one token bucket. Waiting requests are served by
+    priority, and only moves may use the last `move_reserve` tokens, so a
+    burst of challenge traffic never delays a move. After a 429 every
+    request but moves and game stream connections is held back for a
+    minute, and `on_rate_limited` is called so that other sessions of the
+    account can pause as well.
+    """
+
+    RATE_LIMIT_PAUSE = 60
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        *,
+        rate: float = 8,
+        burst: float = 16,
+        move_reserve: float = 2,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.session = session
+        self.bucket = TokenBucket(rate, burst)
+        self.move_reserve = move_reserve
+        self.metrics = metrics
+        self._waiters: "list[tuple[int, int, asyncio.Future]]" = []
+        self._counter = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        # Set when a waiter is pushed to the head of the queue
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0.0
+        self.on_rate_limited: Optional[Callable[[], None]] = None
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _delay(self, priority: RequestPriority) -> float:
+        if priority == RequestPriority.MOVE:
+            return self.bucket.delay()
+        if priority == RequestPriority.GAME_STREAM:
+            # A game that cannot reconnect loses on time
+            return self.bucket.delay(self.move_reserve)
+        return max(
+            self.bucket.delay(self.move_reserve),
+            self._paused_until - time.monotonic(),
+        )
+
+    async def acquire(self, priority: RequestPriority):
+        started = time.perf_counter()
+        # Jump the queue only when nothing of the same or a higher priority waits
+        ahead = self._waiters and self._waiters[0][0] <= priority.value
+        if not ahead and self._delay(priority) == 0:
+            self.bucket.take()
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority.value, next(self._counter), waiter))
+            if self._dispatcher is None or self._dispatcher.done():
+                self._dispatcher = asyncio.create_task(self._dispatch())
+            elif self._waiters[0][2] is waiter:
+                # The dispatcher may be waiting out a longer delay, e.g. a paused challenge
+                self._wakeup.set()
+            await waiter
+        if self.metrics is not None:
+            self.metrics.observe(
+                f"http_wait_{priority.name.lower()}", time.perf_counter() - started
+            )
+
+    async def _dispatch(self):
+        while self._waiters:
+            priority, _, waiter = self._waiters[0]
+            if waiter.done():
+                heapq.heappop(self._waiters)
+                continue
+            delay = self._delay(RequestPriority(priority))
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._waiters)
+            self.bucket.take()
+            waiter.set_result(None)
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        priority: RequestPriority = RequestPriority.HOUSEKEEPING,
+        *,
+        stream: bool = False,
+        **kwargs,
+    ) -> aiohttp.ClientResponse:
+        """Sends a request once the rate limit allows it.
+
+        Unless `stream` is set, the body is read and the connection released
+        before the response is returned.
+        """
+        await self.acquire(priority)
+        r = await self.session.request(method, url, **kwargs)
+        if r.status == 429:
+            self.pause()
+            if self.on_rate_limited is not None:
+                self.on_rate_limited()
+        if not stream:
+            await r.read()
+            r.release()
+        return r
+
+    def pause(self, seconds: float = RATE_LIMIT_PAUSE):
+        """Holds back the requests a 429 holds back for `seconds`."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def get(self, url: str, priority: RequestPriority, **kwargs):
+        return await self.request("GET", url, priority, **kwargs)
+
+    async def post(self, url: str, priority: RequestPriority, **kwargs):
+        return await self.request("POST", url, priority, **kwargs)
+
+    def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+        for _, _, waiter in self._waiters:
+            waiter.cancel()
@@ -0,0 +1,86 @@
+import asyncio
+import time
+from typing import Iterator, Optional
+
+import chess
+
+
+class GameEntry:
+    handler: "GameStreamHandler"
+    task: asyncio.Task
+    load: float
+    started_at: float
+
+    def __init__(self, handler: "GameStreamHandler", task: asyncio.Task, load: float):
+        self.handler = handler
+        self.task = task
+        self.load = load
+        self.started_at = time.time()
+
+    @property
+    def id(self) -> str:
+        return self.handler.game.id
+
+    @property
+    def board(self) -> chess.Board:
+        return self.handler.board
+
+    def stats(self) -> "dict[str, object]":
+        handler = self.handler
+        stats = {
+            "duration": time.time() - self.started_at,
+            "ply": handler.board.ply(),
+            "moves": len(handler.budgets),
+            "sync": handler.sync.stats(),
+        }
+        if handler.ponderer is not None:
+            stats["ponder_hits"] = handler.ponderer.hits
+            stats["ponder_misses"] = handler.ponderer.misses
+        return stats
+
+
+class GameRegistry:
+    """The games in progress, keyed by game ID.
+
+    An entry is removed as soon as its task completes.
+    """
+
+    def __init__(self):
+        self._games: "dict[str, GameEntry]" = {}
+
+    def __contains__(self, game_id: str) -> bool:
+        return game_id in self._games
+
+    def __len__(self) -> int:
+        return len(self._games)
+
+    def __iter__(self) -> Iterator[GameEntry]:
+        return iter(list(self._games.values()))
+
+    def get(self, game_id: str) -> Optional[GameEntry]:
+        return self._games.get(game_id)
+
+    @property
+    def load(self) -> float:
+        return sum(entry.load for entry in self._games.values())
+
+    def add(self, handler: "GameStreamHandler", load: float) -> GameEntry:
+        task = asyncio.create_task(handler.play())
+        entry = GameEntry(handler, task, load)
+        self._games[entry.id] = entry
+        task.add_done_callback(lambda _: self._discard(entry))
+        return entry
+
+    def remove(self, game_id: str) -> Optional[GameEntry]:
+        return self._games.pop(game_id, None)
+
+    def _discard(self, entry: GameEntry):
+        if self._games.get(entry.id) is entry:
+            del self._games[entry.id]
+
+    async def shutdown(self):
+        """Cancels every game task and waits for them to finish."""
+        tasks = [entry.task for entry in self._games.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
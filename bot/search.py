@@ -0,0 +1,185 @@
+import asyncio
+import time
+from typing import Optional
+
+import chess
+import chess.engine
+
+from timemanager import MoveBudget
+
+INFO = chess.engine.INFO_BASIC | chess.engine.INFO_SCORE | chess.engine.INFO_PV
+MATE_SCORE = 100000
+
+
+class AdaptiveSearch:
+    """Searches with `engine.analysis()` and decides when to play from the info stream.
+
+    The move is played before the budgeted time when the best move has not
+    changed for `stability` iterations, or when it is `separation`
+    centipawns ahead of the second best line. The budget is extended, up to
+    its maximum, when the score drops by `drop` centipawns during the search.
+    Engines without the MultiPV option are searched with a single line, and
+    a search the engine rejects falls back to `engine.play()`.
+    """
+
+    MIN_DEPTH = 6
+    MIN_SHARE = 0.25
+    EXTENSION = 1.5
+
+    def __init__(
+        self,
+        *,
+        stability: int = 4,
+        separation: int = 150,
+        drop: int = 30,
+        multipv: int = 2,
+    ):
+        self.stability = stability
+        self.separation = separation
+        self.drop = drop
+        self.multipv = multipv
+        self.searches = 0
+        self.early = 0
+        self.extended = 0
+        self.fallbacks = 0
+        self.saved = 0.0
+
+    @staticmethod
+    def _score(info: chess.engine.InfoDict) -> int:
+        return info["score"].relative.score(mate_score=MATE_SCORE)
+
+    async def play(
+        self,
+        engine: chess.engine.Protocol,
+        board: chess.Board,
+        budget: MoveBudget,
+        *,
+        depth: Optional[int] = None,
+        nodes: Optional[int] = None,
+        **kwargs,
+    ) -> "tuple[chess.engine.PlayResult, str]":
+        """Searches the position and returns the result with the reason the search stopped.
+
+        A search capped by `depth` or `nodes` may stop before its budget is used.
+        """
+        legal = board.legal_moves.count()
+        if legal == 1:
+            self.saved += budget.time
+            return (
+                chess.engine.PlayResult(next(iter(board.legal_moves)), None),
+                "forced",
+            )
+
+        self.searches += 1
+        multipv = min(self.multipv, legal) if "MultiPV" in engine.options else 1
+        try:
+            return await self._search(
+                engine, board, budget, multipv, depth, nodes, **kwargs
+            )
+        except chess.engine.EngineTerminatedError:
+            raise
+        except chess.engine.EngineError:
+            self.fallbacks += 1
+            result = await engine.play(
+                board,
+                chess.engine.Limit(time=budget.time, depth=depth, nodes=nodes),
+                info=INFO,
+                **kwargs,
+            )
+            return result, "fallback"
+
+    async def _search(
+        self,
+        engine: chess.engine.Protocol,
+        board: chess.Board,
+        budget: MoveBudget,
+        multipv: int,
+        depth: Optional[int],
+        nodes: Optional[int],
+        **kwargs,
+    ) -> "tuple[chess.engine.PlayResult, str]":
+        started = time.perf_counter()
+        soft = budget.time
+        minimum = budget.time * self.MIN_SHARE
+        lines: "dict[int, chess.engine.InfoDict]" = {}
+        best: Optional[chess.Move] = None
+        stable = 0
+        reference: Optional[int] = None
+        ready = None
+        reason = "time"
+
+        with await engine.analysis(
+            board,
+            chess.engine.Limit(time=budget.maximum, depth=depth, nodes=nodes),
+            multipv=multipv if multipv > 1 else None,
+            info=INFO,
+            **kwargs,
+        ) as analysis:
+            while True:
+                deadline = minimum if ready is not None else soft
+                timeout = deadline - (time.perf_counter() - started)
+                if timeout <= 0:
+                    if ready is not None:
+                        reason = ready
+                    break
+                try:
+                    info = await asyncio.wait_for(analysis.get(), timeout)
+                except asyncio.TimeoutError:
+                    continue
+                except chess.engine.AnalysisComplete:
+                    reason = "limit"
+                    break
+
+                if (
+                    "pv" not in info
+                    or "score" not in info
+                    or "depth" not in info
+                    or info.get("lowerbound")
+                    or info.get("upperbound")
+                ):
+                    continue
+                index = info.get("multipv", 1)
+                lines[index] = info
+                if index != multipv or 1 not in lines:
+                    continue
+
+                # An iteration is complete
+                depth = lines[1]["depth"]
+                move = lines[1]["pv"][0]
+                score = self._score(lines[1])
+                stable = stable + 1 if move == best else 1
+                best = move
+                if depth < self.MIN_DEPTH:
+                    continue
+
+                if reference is None:
+                    reference = score
+                elif score <= reference - self.drop and soft < budget.maximum:
+                    soft = min(budget.maximum, soft * self.EXTENSION)
+                    reference = score
+                    self.extended += 1
+                    ready = None
+
+                if ready is None and soft == budget.time:
+                    if stable >= self.stability:
+                        ready = "stable"
+                    elif (
+                        multipv > 1
+                        and 2 in lines
+                        and lines[2]["depth"] == depth
+                        and score - self._score(lines[2]) >= self.separation
+                    ):
+                        ready = "separated"
+
+            analysis.stop()
+            bestmove = await analysis.wait()
+
+        elapsed = time.perf_counter() - started
+        if elapsed < budget.time:
+            self.saved += budget.time - elapsed
+            if reason in ("stable", "separated"):
+                self.early += 1
+        info = dict(lines.get(1, {}))
+        if "time" not in info:
+            info["time"] = elapsed
+        return chess.engine.PlayResult(bestmove.move, bestmove.ponder, info), reason
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""A minimal UCI engine for benchmarks.
+
+It plays a random legal move after STUB_ENGINE_DELAY seconds, or earlier if
+the search is stopped, and reports a short fake principal variation.
+"""
+
+import os
+import random
+import sys
+import threading
+
+import chess
+
+DELAY = float(os.getenv("STUB_ENGINE_DELAY", "0"))
+
+
+class StubEngine:
+    def __init__(self):
+        self.board = chess.Board()
+        self.stopped = threading.Event()
+        self.search: "threading.Thread | None" = None
+        self.random = random.Random(0)
+
+    def send(self, line: str):
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+    def position(self, args: "list[str]"):
+        if args[0] == "startpos":
+            self.board = chess.Board()
+            rest = args[1:]
+        else:
+            self.board = chess.Board(" ".join(args[1:7]))
+            rest = args[7:]
+        if rest and rest[0] == "moves":
+            for uci in rest[1:]:
+                self.board.push_uci(uci)
+
+    def go(self, args: "list[str]"):
+        infinite = "infinite" in args or "ponder" in args
+        delay = DELAY
+        if "movetime" in args:
+            delay = min(delay, int(args[args.index("movetime") + 1]) / 1000)
+        board = self.board.copy()
+        self.stopped.clear()
+        self.search = threading.Thread(
+            target=self._search, args=(board, delay, infinite)
+        )
+        self.search.start()
+
+    def _search(self, board: chess.Board, delay: float, infinite: bool):
+        moves = list(board.legal_moves)
+        if not moves:
+            self.send("bestmove (none)")
+            return
+        best = self.random.choice(moves)
+        board.push(best)
+        replies = list(board.legal_moves)
+        ponder = self.random.choice(replies) if replies else None
+        pv = best.uci() + (f" {ponder.uci()}" if ponder else "")
+        self.send(f"info depth 1 seldepth 1 time 0 nodes 1 score cp 0 pv {pv}")
+        if infinite:
+            self.stopped.wait()
+        else:
+            self.stopped.wait(delay)
+        self.send(
+            f"bestmove {best.uci()}" + (f" ponder {ponder.uci()}" if ponder else "")
+        )
+
+    def stop(self):
+        self.stopped.set()
+        if self.search is not None:
+            self.search.join()
+            self.search = None
+
+    def run(self):
+        for line in sys.stdin:
+            command, *args = line.split() or [""]
+            if command == "uci":
+                self.send("id name StubEngine")
+                self.send("option name Threads type spin default 1 min 1 max 512")
+                self.send("option name Hash type spin default 16 min 1 max 33554432")
+                self.send("option name Ponder type check default false")
+                self.send(
+                    "option name Move Overhead type spin default 10 min 0 max 5000"
+                )
+                self.send("option name Skill Level type spin default 20 min 0 max 20")
+                self.send("uciok")
+            elif command == "isready":
+                self.send("readyok")
+            elif command == "position":
+                self.position(args)
+            elif command == "go":
+                self.go(args)
+            elif command in ("stop", "ponderhit"):
+                self.stop()
+            elif command == "quit":
+                self.stop()
+                return
+
+
+if __name__ == "__main__":
+    StubEngine().run()
@@ -0,0 +1,355 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from multiprocessing.connection import Connection
+from typing import Awaitable, Callable, Iterator, Optional
+
+from app import App
+from colorlogs import Logger
+from datamodels import Game
+from looping import Loop
+
+
+class WorkerHandle:
+    index: int
+    process: Optional[multiprocessing.Process]
+    conn: Optional[Connection]
+    games: "dict[str, tuple[dict, float]]"
+    health: "dict[str, object]"
+    last_seen: float
+    restarts: int
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.games = {}
+        self.health = {}
+        self.last_seen = 0.0
+        self.restarts = 0
+
+    @property
+    def load(self) -> float:
+        return sum(load for _, load in self.games.values())
+
+
+class WorkerPool:
+    """The games in progress across a pool of worker processes.
+
+    It takes the place of the `GameRegistry` in the supervisor. Every game is
+    dispatched to the least loaded worker. `ready` is set once a worker
+    reports that its engines are ready. A worker that exits or stops
+    reporting is replaced, and its games are resumed on another worker, which
+    picks each of them up from the game stream. A 429 seen by a worker
+    pauses the requests of all other workers and of the supervisor.
+    """
+
+    REPORT_TIMEOUT = 30
+    STOP_TIMEOUT = 10
+
+    def __init__(
+        self,
+        size: int,
+        log: Logger,
+        on_finished: Callable[[str, "dict[str, object]"], Awaitable],
+        on_rate_limited: Callable[[], None],
+    ):
+        self.size = max(1, size)
+        self.log = log
+        self.on_finished = on_finished
+        self.on_rate_limited = on_rate_limited
+        self.workers = [WorkerHandle(i) for i in range(self.size)]
+        self.ready = asyncio.Event()
+        self._context = multiprocessing.get_context("spawn")
+        self._tasks: "set[asyncio.Task]" = set()
+
+    def __contains__(self, game_id: str) -> bool:
+        return any(game_id in worker.games for worker in self.workers)
+
+    def __len__(self) -> int:
+        return sum(len(worker.games) for worker in self.workers)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([game_id for worker in self.workers for game_id in worker.games])
+
+    @property
+    def load(self) -> float:
+        return sum(worker.load for worker in self.workers)
+
+    @property
+    def restarts(self) -> int:
+        return sum(worker.restarts for worker in self.workers)
+
+    def total(self, name: str) -> float:
+        """Sums a value of the latest health reports."""
+        return sum(worker.health.get(name, 0) for worker in self.workers)
+
+    def start(self):
+        for worker in self.workers:
+            self._spawn(worker)
+        self.log.info("Started %s worker(s)", self.size)
+
+    def _spawn(self, worker: WorkerHandle):
+        conn, child = self._context.Pipe()
+        worker.process = self._context.Process(
+            target=run_worker,
+            args=(worker.index, self.size, child),
+            name=f"hermes-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+        child.close()
+        worker.conn = conn
+        worker.last_seen = time.monotonic()
+        asyncio.get_running_loop().add_reader(conn.fileno(), self._receive, worker)
+
+    def _detach(self, worker: WorkerHandle):
+        if worker.conn is None:
+            return
+        asyncio.get_running_loop().remove_reader(worker.conn.fileno())
+        worker.conn.close()
+        worker.conn = None
+
+    def _replace(self, worker: WorkerHandle):
+        self._detach(worker)
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join(1)
+        worker.restarts += 1
+        orphans = worker.games
+        worker.games = {}
+        worker.health = {}
+        self._spawn(worker)
+        for game_id, (game, load) in orphans.items():
+            self.log.warning("Resuming game %s of worker #%s", game_id, worker.index)
+            self.dispatch(game, load, exclude=worker)
+
+    def _receive(self, worker: WorkerHandle):
+        try:
+            while worker.conn is not None and worker.conn.poll():
+                self._handle(worker, worker.conn.recv())
+        except (EOFError, OSError):
+            self.log.error("Worker #%s exited", worker.index)
+            self._replace(worker)
+
+    def _handle(self, worker: WorkerHandle, message: tuple):
+        worker.last_seen = time.monotonic()
+        if message[0] == "health":
+            worker.health = message[1]
+            if worker.health.get("ready"):
+                self.ready.set()
+        elif message[0] == "finished":
+            _, game_id, stats = message
+            if worker.games.pop(game_id, None) is not None:
+                task = asyncio.create_task(self.on_finished(game_id, stats))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        elif message[0] == "rate_limited":
+            self.log.warning("Worker #%s was rate limited", worker.index)
+            self.pause(exclude=worker)
+            self.on_rate_limited()
+
+    def _send(self, worker: WorkerHandle, message: tuple):
+        try:
+            worker.conn.send(message)
+        except OSError:
+            self.log.error("Lost the connection to worker #%s", worker.index)
+            self._replace(worker)
+
+    def pause(self, exclude: Optional[WorkerHandle] = None):
+        """Pauses the requests of every worker but `exclude` as after a 429."""
+        for worker in self.workers:
+            if worker is not exclude and worker.conn is not None:
+                self._send(worker, ("pause",))
+
+    def dispatch(self, game: dict, load: float, exclude: Optional[WorkerHandle] = None):
+        """Starts a game, given as its gameStart JSON, on the least loaded worker."""
+        candidates = [w for w in self.workers if w is not exclude] or self.workers
+        worker = min(candidates, key=lambda w: (w.load, len(w.games)))
+        worker.games[game["gameId"]] = (game, load)
+        self._send(worker, ("start", game, load))
+
+    async def health_check(self):
+        now = time.monotonic()
+        for worker in self.workers:
+            if not worker.process.is_alive():
+                self.log.error(
+                    "Worker #%s exited with code %s",
+                    worker.index,
+                    worker.process.exitcode,
+                )
+                self._replace(worker)
+            elif now - worker.last_seen > self.REPORT_TIMEOUT:
+                self.log.error("Worker #%s stopped reporting", worker.index)
+                self._replace(worker)
+
+    async def shutdown(self):
+        """Asks every worker to stop and waits for them to exit."""
+        for worker in self.workers:
+            if worker.conn is not None:
+                try:
+                    worker.conn.send(("stop",))
+                except OSError:
+                    pass
+            self._detach(worker)
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            await loop.run_in_executor(None, worker.process.join, self.STOP_TIMEOUT)
+            if worker.process.is_alive():
+                worker.process.kill()
+
+
+class SupervisorApp(App):
+    """Owns the event stream and admission, and plays the games on worker processes.
+
+    Every worker runs a `WorkerApp` with its own event loop, session and
+    engine pool, so decoding and board work of many games is spread across
+    CPU cores.
+    """
+
+    games: WorkerPool
+
+    # Share of the account's request rate kept for the event stream and
+    # challenges, the rest is split across the workers
+    HTTP_SHARE = 0.25
+    STARTUP_PHASES = ("workers", "preconnect", "stream")
+
+    def __init__(self, workers: int):
+        super().__init__()
+        self.games = WorkerPool(
+            workers, self.log, self.game_finished, lambda: self.http.pause()
+        )
+
+    async def setup(self):
+        self.setup_http(self.HTTP_SHARE)
+        self.http.on_rate_limited = self.games.pause
+        self.games.start()
+        self.setup_profiling()
+        await self.setup_metrics()
+        self.setup_admission(self.games.size * int(os.getenv("ENGINE_POOL_SIZE", "1")))
+        self.setup_matchmaking()
+        self.metrics.gauge(
+            "engines_idle",
+            "Engines not leased by any game.",
+            lambda: self.games.total("engines_idle"),
+        )
+        self.metrics.gauge(
+            "engines_queued",
+            "Games waiting for an engine.",
+            lambda: self.games.total("engines_queued"),
+        )
+        self.metrics.counter(
+            "worker_restarts_total",
+            "Worker processes replaced after a crash or hang.",
+            lambda: self.games.restarts,
+        )
+        self.add_loop(Loop(self.games.health_check, seconds=5))
+
+    async def start(self):
+        await asyncio.gather(
+            self.startup.run("workers", self.games.ready.wait()), self.preconnect()
+        )
+        self.open_admission()
+
+    def start_game(self, game: Game, load: float):
+        self.games.dispatch(game.to_json(), load)
+
+    async def log_metrics(self):
+        await super().log_metrics()
+        for worker in self.games.workers:
+            if worker.health.get("summary"):
+                self.log.info(
+                    "Worker #%s latency summary: %s",
+                    worker.index,
+                    worker.health["summary"],
+                )
+
+
+class WorkerApp(App):
+    """Plays the games a `SupervisorApp` dispatches to it and reports back."""
+
+    REPORT_INTERVAL = 2
+    STARTUP_PHASES = ("engines",)
+
+    def __init__(self, index: int, workers: int, conn: Connection):
+        super().__init__()
+        self.index = index
+        self.workers = workers
+        self.conn = conn
+        self.log.name = f"BOT-{index}"
+        self._stopped: Optional[asyncio.Event] = None
+        self.main(self.serve)
+
+    async def setup(self):
+        # The Lichess rate limit is per account, so it is split across workers
+        self.setup_http((1 - SupervisorApp.HTTP_SHARE) / self.workers)
+        self.http.on_rate_limited = lambda: self._send(("rate_limited",))
+        self.setup_engines()
+        self.setup_profiling()
+        await self.setup_search()
+        self.setup_archive(f"games-{self.index}")
+        self.add_loop(Loop(self.report, seconds=self.REPORT_INTERVAL))
+
+    async def start(self):
+        await self.start_engines()
+        # Let the supervisor know without waiting for the next report
+        await self.report()
+
+    async def serve(self):
+        self._stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.conn.fileno(), self._receive)
+        try:
+            await self._stopped.wait()
+        finally:
+            loop.remove_reader(self.conn.fileno())
+
+    def _receive(self):
+        try:
+            while self.conn.poll():
+                message = self.conn.recv()
+                if message[0] == "start":
+                    _, data, load = message
+                    game = Game.from_json(data)
+                    if game.id not in self.games:
+                        self.log.info("Starting a game, ID: %s", game.id)
+                        self.start_game(game, load)
+                elif message[0] == "pause":
+                    self.http.pause()
+                elif message[0] == "stop":
+                    self._stopped.set()
+                    return
+        except (EOFError, OSError):
+            self.log.error("Lost the connection to the supervisor")
+            self._stopped.set()
+
+    def _send(self, message: tuple):
+        try:
+            self.conn.send(message)
+        except OSError:
+            self._stopped.set()
+
+    async def report(self):
+        self._send(
+            (
+                "health",
+                {
+                    "games": len(self.games),
+                    "ready": self.engines.ready.is_set(),
+                    "engines_idle": self.engines.idle,
+                    "engines_queued": self.engines.queued,
+                    "summary": self.metrics.summary(),
+                    "stats": {entry.id: entry.stats() for entry in self.games},
+                },
+            )
+        )
+
+    async def game_finished(self, game_id: str, stats: "dict[str, object]"):
+        self._send(("finished", game_id, stats))
+
+
+def run_worker(index: int, workers: int, conn: Connection):
+    WorkerApp(index, workers, conn).run()
@@ -0,0 +1,84 @@
+import asyncio
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import chess
+import chess.polyglot
+import chess.syzygy
+
+
+class Tablebase:
+    """Syzygy endgame tablebases.
+
+    Probes read the table files, so they run on a worker thread instead of
+    the event loop. Best moves are kept in an LRU cache keyed by position.
+    """
+
+    def __init__(self, directory: str, *, max_pieces: int = 6, cache_size: int = 4096):
+        self.max_pieces = max_pieces
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        directories = [d for d in directory.split(os.pathsep) if d]
+        self.tablebase = chess.syzygy.open_tablebase(directories[0])
+        for d in directories[1:]:
+            self.tablebase.add_directory(d)
+        self._cache: "OrderedDict[tuple[int, int], Optional[chess.Move]]" = (
+            OrderedDict()
+        )
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="syzygy")
+
+    def covers(self, board: chess.Board) -> bool:
+        return (
+            chess.popcount(board.occupied) <= self.max_pieces
+            and not board.castling_rights
+        )
+
+    async def probe(self, board: chess.Board) -> Optional[chess.Move]:
+        """Returns the DTZ-optimal move, or None if the position is not covered."""
+        if not self.covers(board):
+            return None
+
+        key = (chess.polyglot.zobrist_hash(board), board.halfmove_clock)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return self._cache[key]
+
+        self.misses += 1
+        move = await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._best_move, board.copy(stack=False)
+        )
+        self._cache[key] = move
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return move
+
+    def _best_move(self, board: chess.Board) -> Optional[chess.Move]:
+        best = None
+        best_key = None
+        try:
+            for move in board.legal_moves:
+                zeroing = board.is_zeroing(move)
+                board.push(move)
+                try:
+                    if board.is_checkmate():
+                        key = (-2, -1)
+                    else:
+                        wdl = -self.tablebase.probe_wdl(board)
+                        dtz = -self.tablebase.probe_dtz(board)
+                        # Resetting the fifty-move counter is the fastest progress in a won position
+                        key = (-wdl, 0 if zeroing and wdl > 0 else dtz)
+                finally:
+                    board.pop()
+                if best_key is None or key < best_key:
+                    best, best_key = move, key
+        except (KeyError, chess.syzygy.MissingTableError):
+            return None
+        return best
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.tablebase.close()
@@ -0,0 +1,114 @@
+from typing import Optional
+
+from enums import Variant
+
+
+def parse_margins(spec: Optional[str]) -> "dict[Variant, float]":
+    """Parses safety margins by variant, e.g. `atomic:0.5,crazyhouse:0.8` in seconds."""
+    margins = {}
+    if not spec:
+        return margins
+    for entry in spec.split(","):
+        name, margin = entry.strip().split(":")
+        try:
+            variant = Variant(name.strip())
+        except ValueError:
+            raise ValueError(
+                f"Unknown variant {name!r} in the time margins, expected one of "
+                f"{sorted(v.value for v in Variant)}"
+            )
+        margins[variant] = float(margin)
+    return margins
+
+
+class MoveBudget:
+    time: float
+    clock: float
+    increment: float
+    latency: float
+    panic: bool
+    maximum: float
+
+    def __init__(
+        self,
+        time: float,
+        clock: float,
+        increment: float,
+        latency: float,
+        panic: bool,
+        maximum: Optional[float] = None,
+    ):
+        self.time = time
+        self.clock = clock
+        self.increment = increment
+        self.latency = latency
+        self.panic = panic
+        self.maximum = max(time, maximum or time)
+
+    def __str__(self):
+        return (
+            f"budget {self.time:.3f}s (clock {self.clock:.1f}s, inc {self.increment:.1f}s, "
+            f"latency {self.latency:.3f}s{', panic' if self.panic else ''})"
+        )
+
+
+class TimeManager:
+    """Allocates the thinking time of a move from the remaining clock.
+
+    The reserve kept on the clock covers the measured latency of move
+    requests and a safety margin that can differ per variant. Outside of
+    panic, a search may be extended up to `MAX_EXTENSION` times its budget.
+    """
+
+    MIN_TIME = 0.01
+    MIN_MOVES_TO_GO = 20
+    MAX_CLOCK_SHARE = 0.25
+    MAX_EXTENSION = 3
+
+    def __init__(
+        self,
+        *,
+        safety_margin: float = 0.3,
+        variant_margins: "Optional[dict[Variant, float]]" = None,
+        panic_time: float = 5,
+        moves_to_go: int = 40,
+        latency_smoothing: float = 0.2,
+    ):
+        self.safety_margin = safety_margin
+        self.variant_margins = variant_margins or {}
+        self.panic_time = panic_time
+        self.moves_to_go = moves_to_go
+        self.latency_smoothing = latency_smoothing
+        self.latency = 0.0
+
+    def record_latency(self, seconds: float):
+        """Adds a move request round trip to the moving average of the latency."""
+        if self.latency == 0:
+            self.latency = seconds
+        else:
+            self.latency += self.latency_smoothing * (seconds - self.latency)
+
+    def margin(self, variant: Variant) -> float:
+        return self.variant_margins.get(variant, self.safety_margin)
+
+    def allocate(
+        self, clock_ms: int, inc_ms: int, ply: int, variant: Variant = Variant.STANDARD
+    ) -> MoveBudget:
+        clock = clock_ms / 1000
+        inc = inc_ms / 1000
+        reserve = 2 * self.latency + self.margin(variant)
+        available = max(0.0, clock - reserve)
+        panic = clock <= self.panic_time
+
+        if panic:
+            # Only the increment and a sliver of what is left
+            time = min(available / self.moves_to_go, inc / 2 + available / 100)
+            maximum = time
+        else:
+            moves_to_go = max(self.MIN_MOVES_TO_GO, self.moves_to_go - ply // 4)
+            time = available / moves_to_go + 0.75 * inc
+            time = min(time, available * self.MAX_CLOCK_SHARE)
+            maximum = min(time * self.MAX_EXTENSION, available * self.MAX_CLOCK_SHARE)
+
+        time = max(self.MIN_TIME, time)
+        return MoveBudget(time, clock, inc, self.latency, panic, maximum)
@@ -1,34 +1,72 @@
-from json import JSONDecodeError, loads
-from random import randint
-from typing import Any
+import time
+from typing import Any, AsyncIterator, Callable, Optional
+
+import aiohttp
 
 from errors import JSONDecodeFailure
+from metrics import Metrics
+
+try:
+    from orjson import JSONDecodeError, loads
+except ImportError:
+    from json import JSONDecodeError, loads
 
 
 def decode_json(raw: bytes) -> "list[dict[str, Any]]":
     raw_ls = raw.split(b"\n")
     try:
-        return [loads(r) for r in raw_ls if len(r) > 0]
+        return [loads(r) for r in raw_ls if len(r.strip()) > 0]
     except JSONDecodeError:
         raise JSONDecodeFailure()
 
 
-def get_time(clock: int, inc: int):
-    clock /= 100000
-    inc /= 1000
-    time = None
-    if clock < inc:
-        time = clock
-    else:
-        time = clock + inc
-        if time < 1.5:
-            time = 0.1
-        elif time > 12:
-            time = 12
+async def iter_ndjson(
+    stream: aiohttp.StreamReader,
+    on_error: Optional[Callable[[bytes], Any]] = None,
+    metrics: Optional[Metrics] = None,
+    on_chunk: Optional[Callable[[], Any]] = None,
+) -> "AsyncIterator[dict[str, Any]]":
+    """Yields the JSON objects of a newline delimited stream.
+
+    Lines split across chunks are buffered until they are complete, and
+    keep-alive newlines are skipped. Lines that fail to decode are passed to
+    `on_error` if it is given, and `on_chunk` is called as every chunk
+    arrives. The objects yielded until the next call are the ones the
+    chunk completed.
+
+    With `metrics`, the decode time of every line is observed.
+    """
+    buffer = bytearray()
+    async for chunk in stream.iter_any():
+        if not buffer and (chunk == b"\n" or chunk == b"\n\n"):
+            continue
 
-    return shuffle(time)
+        if on_chunk is not None:
+            on_chunk()
+        buffer += chunk
+        end = buffer.rfind(b"\n")
+        if end == -1:
+            continue
 
+        lines = buffer[:end].split(b"\n")
+        del buffer[: end + 1]
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                started = time.perf_counter()
+                data = loads(line)
+            except JSONDecodeError:
+                if on_error is not None:
+                    on_error(bytes(line))
+                continue
+            if metrics is not None:
+                metrics.observe("json_decode", time.perf_counter() - started)
+            yield data
 
-def shuffle(n: int):
-    r = int(n * 2)
-    return (n + randint(-r, r)) / 10
+    if buffer.strip():
+        try:
+            yield loads(buffer)
+        except JSONDecodeError:
+            if on_error is not None:
+                on_error(bytes(buffer))